@@ -0,0 +1,120 @@
+"""Content fingerprinted static assets.
+
+Assets are copied into the site under names carrying a hash of their
+content, ``css/site.css`` becomes ``css/site.0123456789ab.css``, so
+published copies never change and can be cached indefinitely. The
+manifest maps asset paths to their fingerprinted names for templates.
+"""
+
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+
+log = logging.getLogger("apichanges.assets")
+
+HASH_LENGTH = 12
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{%d}\.[^./]+$" % HASH_LENGTH)
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+# asset directories under the site root, icons are only copied on full builds
+ASSET_TYPES = ("css", "js", "sprite", "icons")
+
+
+def is_fingerprinted(name):
+    return bool(FINGERPRINTED.search(str(name)))
+
+
+def fingerprint(path: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    stem, sep, ext = path.rpartition(".")
+    if not sep or "/" in ext:
+        return "%s.%s" % (path, digest)
+    return "%s.%s.%s" % (stem, digest, ext)
+
+
+def prune_fingerprinted(target: Path, name: str):
+    """remove other fingerprinted copies of asset name next to target."""
+    digest = r"\.[0-9a-f]{%d}" % HASH_LENGTH
+    stem, sep, ext = name.rpartition(".")
+    if sep:
+        pattern = re.compile(re.escape(stem) + digest + re.escape(sep + ext) + "$")
+    else:
+        pattern = re.compile(re.escape(name) + digest + "$")
+    pruned = []
+    for p in target.parent.iterdir():
+        if p.name != target.name and pattern.match(p.name):
+            p.unlink()
+            pruned.append(p)
+    return pruned
+
+
+def rewrite_css_urls(path: str, text: str, manifest) -> str:
+    """point relative url() references in a stylesheet at fingerprinted names."""
+    base = os.path.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(("/", "data:", "#")) or "://" in url:
+            return match.group()
+        url, sep, suffix = url.partition("?")
+        target = os.path.normpath(os.path.join(base, url)).replace(os.sep, "/")
+        if target not in manifest:
+            return match.group()
+        url = os.path.relpath(manifest[target], base or ".").replace(os.sep, "/")
+        return "url(%s%s%s%s%s)" % (quote, url, sep, suffix, quote)
+
+    return CSS_URL.sub(replace, text)
+
+
+def write_if_changed(target: Path, data: bytes) -> bool:
+    if target.exists() and target.read_bytes() == data:
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_bytes(data)
+    return True
+
+
+def copy_assets(assets_dir: Path, output: Path, asset_types, fingerprints=True):
+    """copy asset directories into the site.
+
+    Returns the manifest of asset paths to fingerprinted paths, and the
+    site relative paths actually written, unchanged assets are skipped.
+    Assets are also kept under their plain names, for pages rendered
+    before fingerprinting, while older fingerprinted copies are removed.
+    """
+    sources = {}
+    for atype in asset_types:
+        adir = assets_dir / atype
+        if not adir.is_dir():
+            continue
+        for dirpath, dirnames, files in os.walk(adir):
+            for f in files:
+                p = Path(dirpath) / f
+                sources[p.relative_to(assets_dir).as_posix()] = p
+
+    manifest = {}
+    written = []
+    pruned = 0
+    # stylesheets last, so their url() references can be rewritten
+    for path in sorted(sources, key=lambda p: (p.endswith(".css"), p)):
+        data = sources[path].read_bytes()
+        if fingerprints and path.endswith(".css"):
+            data = rewrite_css_urls(path, data.decode("utf8"), manifest).encode("utf8")
+        if write_if_changed(output / path, data):
+            written.append(path)
+        if not fingerprints:
+            continue
+        manifest[path] = fingerprint(path, data)
+        target = output / manifest[path]
+        if not target.exists():
+            target.write_bytes(data)
+            written.append(manifest[path])
+            pruned += len(prune_fingerprinted(target, sources[path].name))
+    log.info(
+        "copied assets %d files %d changed %d pruned",
+        len(sources),
+        len(written),
+        pruned,
+    )
+    return manifest, written
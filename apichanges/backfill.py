@@ -0,0 +1,70 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from . import record
+from .cache import DiffCache
+from .sitebuild import Site
+
+log = logging.getLogger("apichanges.backfill")
+
+
+def shard_path(output_dir, shard, count):
+    return Path(output_dir) / ("shard-%03d-of-%03d.cache" % (shard, count))
+
+
+def diff_cache_path(output_dir, shard):
+    return Path(output_dir) / ("diffs-%03d.db" % shard)
+
+
+def run_shard(site_options, since, until, shard, count, output_dir):
+    """diff one shard of a backfill into its partial commit cache.
+
+    every worker computes the same shard ranges from since and until,
+    so shards can run on separate nodes given only their number. each
+    shard keeps its own diff cache, sqlite doesn't share well across
+    processes.
+    """
+    site = Site(diff_cache_path=diff_cache_path(output_dir, shard), **site_options)
+    ranges = site.get_walker(site.repo_path).shard_ranges(since, until, count)
+    path = shard_path(output_dir, shard, count)
+    commits = []
+    if shard < len(ranges):
+        shard_since, shard_until = ranges[shard]
+        log.info("shard %d/%d %s..%s", shard, count, shard_since, shard_until)
+        # change logs are read as of the end of the whole backfill
+        commits = site.load_shard(shard_since, shard_until, ranges[-1][1])
+    path.write_bytes(record.dumps(commits, compact=True))
+    return path
+
+
+def load_shards(paths):
+    return [record.loads(Path(p).read_bytes()) for p in paths]
+
+
+def merge_diff_caches(output_dir, count, target):
+    """fold the shard diff caches found in output_dir into the target
+    diff cache, and remove them."""
+    paths = [diff_cache_path(output_dir, k) for k in range(count)]
+    paths = [p for p in paths if p.exists()]
+    if not paths:
+        return
+    cache = DiffCache(target)
+    merged = 0
+    for p in paths:
+        merged += cache.merge(p)
+    cache.close()
+    for p in paths:
+        p.unlink()
+    log.info("merged %d shard diff caches %d entries", len(paths), merged)
+
+
+def backfill(site_options, since, until, count, output_dir, workers=1):
+    """run every shard locally across worker processes, in shard order."""
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    shards = range(count)
+    args = [(site_options, since, until, k, count, output_dir) for k in shards]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            return list(executor.map(run_shard, *zip(*args)))
+    return [run_shard(*a) for a in args]
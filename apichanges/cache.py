@@ -0,0 +1,130 @@
+import json
+import logging
+import sqlite3
+from collections import Counter
+
+from .model import NewMethod, ServiceChange, ServiceSummary, UpdatedMethod
+
+log = logging.getLogger("apichanges.cache")
+
+
+def encode_delta(obj):
+    if isinstance(obj, set):
+        return {"__set__": sorted(obj)}
+    raise TypeError("unserializable delta %r" % (obj,))
+
+
+def decode_delta(obj):
+    if len(obj) == 1 and "__set__" in obj:
+        return set(obj["__set__"])
+    return obj
+
+
+def encode_change(svc_change):
+    if svc_change is None:
+        return None
+    service = svc_change.service
+    return {
+        "service_name": service.service_name,
+        "metadata": service.metadata,
+        "new": svc_change.new,
+        "changes": [[c.type, c.op, getattr(c, "delta", None)] for c in svc_change],
+    }
+
+
+def decode_change(data):
+    if data is None:
+        return None
+    service = ServiceSummary(data["service_name"], data["metadata"])
+    changes = []
+    for ctype, op, delta in data["changes"]:
+        if ctype == "new":
+            changes.append(NewMethod(service, op))
+        else:
+            changes.append(UpdatedMethod(service, op, delta))
+    return ServiceChange(service, changes, new=data["new"])
+
+
+class DiffCache(object):
+    """Durable store of model diff results.
+
+    The diff of two model blobs never changes, so results are keyed on
+    the old and new blob ids and the differ version. Releases without
+    api changes are stored as well, so they aren't re-diffed either.
+
+    Keys may instead be canonical content hashes, so a store shared
+    across sdk repos diffs each distinct model change once regardless
+    of how each sdk formats its model files. The blob id to content
+    hash mapping is kept as well.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "create table if not exists diffs ("
+            "old_id text, new_id text, version integer, data text, "
+            "primary key (old_id, new_id, version))"
+        )
+        self.conn.execute(
+            "create table if not exists content ("
+            "blob_id text primary key, content_hash text)"
+        )
+        self.stats = Counter()
+
+    def get(self, old_id, new_id, version):
+        """returns a (found, service change) tuple."""
+        row = self.conn.execute(
+            "select data from diffs where old_id = ? and new_id = ? and version = ?",
+            (old_id, new_id, version),
+        ).fetchone()
+        if row is None:
+            self.stats["miss"] += 1
+            return False, None
+        self.stats["hit"] += 1
+        return True, decode_change(json.loads(row[0], object_hook=decode_delta))
+
+    def put(self, old_id, new_id, version, svc_change):
+        try:
+            data = json.dumps(encode_change(svc_change), default=encode_delta)
+        except TypeError as e:
+            log.warning("diff result not cached %s..%s: %s", old_id, new_id, e)
+            return
+        self.conn.execute(
+            "insert or replace into diffs values (?, ?, ?, ?)",
+            (old_id, new_id, version, data),
+        )
+
+    def get_content_hash(self, blob_id):
+        row = self.conn.execute(
+            "select content_hash from content where blob_id = ?", (blob_id,)
+        ).fetchone()
+        return row and row[0] or None
+
+    def put_content_hash(self, blob_id, content_hash):
+        self.conn.execute(
+            "insert or replace into content values (?, ?)", (blob_id, content_hash)
+        )
+
+    def merge(self, path):
+        """copy the entries of another diff cache, keeping existing ones."""
+        self.flush()
+        self.conn.execute("attach database ? as other", (str(path),))
+        try:
+            before = self.conn.total_changes
+            self.conn.execute("insert or ignore into diffs select * from other.diffs")
+            self.conn.execute(
+                "insert or ignore into content select * from other.content"
+            )
+            self.flush()
+        finally:
+            self.conn.execute("detach database other")
+        return self.conn.total_changes - before
+
+    def flush(self):
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+        log.info("diff cache hits:%d misses:%d", self.stats["hit"], self.stats["miss"])
@@ -1,13 +1,15 @@
+import heapq
 import itertools
+import json
 import logging
 import os
+import shlex
+from pathlib import Path
 
 import click
-import jinja2
-import pygit2
 
-from .model import ReleaseDelta
-from .repo import CommitProcessor, TagWalker
+# command dependencies are imported within each command, so help and
+# short invocations don't pay for botocore, pygit2 or the site build.
 
 log = logging.getLogger("apichanges")
 
@@ -20,7 +22,12 @@ def cli():
 
 def _repo_stream_options(func):
     decorators = [
-        click.option("--path", required=True, help="Path to AWS SDK git clone"),
+        click.option(
+            "--path",
+            required=True,
+            multiple=True,
+            help="Path to AWS SDK git clone, repeat for several sdks",
+        ),
         click.option("--since", required=True, help="Start Date or Tag"),
         click.option("--until", help="End Date or Tag, default: last commit date"),
         click.option(
@@ -31,8 +38,18 @@ def _repo_stream_options(func):
             default=".changes",
             help="sdk release changes json dir in repo",
         ),
-        click.option("--model-path", help="model directory prefix", required=True),
-        click.option("--model-suffix", help="suffix for model files", required=True),
+        click.option(
+            "--model-path",
+            multiple=True,
+            required=True,
+            help="model directory prefix, per --path or one for all",
+        ),
+        click.option(
+            "--model-suffix",
+            multiple=True,
+            required=True,
+            help="suffix for model files, per --path or one for all",
+        ),
     ]
     for d in decorators:
         func = d(func)
@@ -47,6 +64,46 @@ def _repo_stream_options(func):
     type=click.Path(exists=True, resolve_path=True),
 )
 @click.option("--output", type=click.Path(resolve_path=True))
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["html", "ndjson"]),
+    default="html",
+    help="Render the template, or stream json lines to --output or stdout",
+)
+@click.option(
+    "--records",
+    "record_type",
+    type=click.Choice(["release", "service"]),
+    default="release",
+    help="ndjson record per release or per service change",
+)
+@click.option(
+    "--order",
+    type=click.Choice(["asc", "desc"]),
+    default="asc",
+    help="Release order, desc walks tags newest first",
+)
+@click.option(
+    "--diff-cache",
+    type=click.Path(resolve_path=True),
+    help="Path to persistent diff result store",
+)
+@click.option(
+    "--preload-changes",
+    is_flag=True,
+    default=False,
+    help="Read all release change logs from the end tag up front",
+)
+@click.option(
+    "--workers", type=int, default=0, help="Processes decoding preloaded change logs"
+)
+@click.option(
+    "--canonical-diffs",
+    is_flag=True,
+    default=False,
+    help="Key diff results on model content, implied with several sdks",
+)
 @_repo_stream_options
 def build_page(
     path,
@@ -55,49 +112,141 @@ def build_page(
     service,
     template,
     output,
+    output_format,
+    record_type,
+    order,
+    diff_cache,
+    preload_changes,
+    workers,
+    canonical_diffs,
     changes_dir,
     model_path,
     model_suffix,
     debug,
 ):
-    """build a single page site"""
-    repo = pygit2.Repository(path)
-    releases = []
-    count = 0
+    """build a single page site, or stream release records as ndjson"""
+    import jinja2
+    import pygit2
 
-    walker = TagWalker(repo)
-    delta_processor = CommitProcessor(
-        repo,
-        model_prefix=model_path,
-        model_suffix=model_suffix,
-        change_dir=changes_dir,
-        services=service,
-        debug=debug,
+    from .cache import DiffCache
+    from .model import ReleaseDelta
+    from .repo import CommitProcessor, TagWalker
+    from .sitebuild import peak_rss, sizeof_fmt
+
+    sdks = []
+    for name, values in (
+        ("--model-path", model_path),
+        ("--model-suffix", model_suffix),
+    ):
+        if len(values) not in (1, len(path)):
+            raise click.UsageError("%s should be given once or once per --path" % name)
+    for idx, repo_path in enumerate(path):
+        sdks.append(
+            (
+                repo_path,
+                model_path[len(model_path) > 1 and idx or 0],
+                model_suffix[len(model_suffix) > 1 and idx or 0],
+            )
+        )
+
+    # several sdks ship the same models, a shared content keyed diff
+    # store diffs each distinct model change once across all of them.
+    canonical_diffs = canonical_diffs or len(sdks) > 1
+    if diff_cache or len(sdks) > 1:
+        diff_cache = DiffCache(diff_cache or ":memory:")
+
+    def sdk_releases(repo_path, sdk_model_path, sdk_model_suffix):
+        repo = pygit2.Repository(repo_path)
+        walker = TagWalker(repo)
+        delta_processor = CommitProcessor(
+            repo,
+            model_prefix=sdk_model_path,
+            model_suffix=sdk_model_suffix,
+            change_dir=changes_dir,
+            services=service,
+            debug=debug,
+            diff_cache=diff_cache or None,
+            canonical=canonical_diffs,
+        )
+
+        if service:
+            known = delta_processor.get_service_paths(walker.get_end_tree(until))
+            unknown = set(service).difference(known)
+            if unknown:
+                raise click.UsageError(
+                    "unknown services in %s: %s"
+                    % (repo_path, ", ".join(sorted(unknown)))
+                )
+
+        if preload_changes and changes_dir:
+            delta_processor.preload_change_logs(walker.get_end_tree(until), workers)
+
+        log.info(
+            "scanning %s for api changes since %s until %s",
+            repo_path,
+            since,
+            until or "latest",
+        )
+
+        sdk = os.path.basename(os.path.normpath(repo_path))
+        for prev, cur, commit_info, change_diff in walker.walk(
+            since, until, reverse=order == "desc"
+        ):
+            stats["commits"] += 1
+            commit_info["sdk"] = sdk
+            service_changes = delta_processor.process(commit_info, change_diff)
+            if service_changes:
+                release = ReleaseDelta(commit_info, service_changes)
+                log.info(release)
+                yield release
+        delta_processor.aliases.report()
+
+    stats = {"commits": 0, "releases": 0, "changes": 0, "updates": 0}
+    services = set()
+    # each sdk walk is in tag order, merge them lazily by release date
+    releases = heapq.merge(
+        *[sdk_releases(*sdk) for sdk in sdks],
+        key=lambda r: r.commit["created_at"],
+        reverse=order == "desc"
     )
 
-    log.info("scanning for api changes since %s until %s", since, until or "latest")
+    if output_format == "ndjson":
+        from .record import encode_value
+
+        with click.open_file(output or "-", "w") as fh:
+            for release in releases:
+                count_release(release, stats, services)
+                for record in release_records(release, record_type):
+                    fh.write(
+                        json.dumps(record, separators=(",", ":"), default=encode_value)
+                    )
+                    fh.write("\n")
+                # downstream readers see each release as soon as it's diffed
+                fh.flush()
+    else:
+        releases = list(releases)
+        for release in releases:
+            count_release(release, stats, services)
 
-    for prev, cur, commit_info, change_diff in walker.walk(since, until):
-        count += 1
-        service_changes = delta_processor.process(commit_info, change_diff)
-        if service_changes:
-            release = ReleaseDelta(commit_info, service_changes)
-            log.info(release)
-            releases.append(releases)
+    if diff_cache:
+        diff_cache.close()
 
     log.info(
-        ("processed %d/%d releases, " "%d svc %d api updates across %d services"),
-        len(releases),
-        count,
-        sum(map(len, releases)),
-        sum(map(len, [svc.changes for svc in itertools.chain(*[r for r in releases])])),
-        len({s.name for s in itertools.chain(*[r for r in releases])}),
+        (
+            "processed %d/%d releases, "
+            "%d svc %d api updates across %d services, peak rss %s"
+        ),
+        stats["releases"],
+        stats["commits"],
+        stats["changes"],
+        stats["updates"],
+        len(services),
+        sizeof_fmt(peak_rss()),
     )
 
-    # sort changes regardless of walk direction by reverse date
-    releases = sorted(releases, key=lambda c: c.commit["created_at"], reverse=True)
-
-    if template and output:
+    if output_format == "html" and template and output:
+        # sort changes regardless of walk direction by reverse date
+        releases = sorted(releases, key=lambda c: c.commit["created_at"], reverse=True)
         log.info("rendering template %s to %s", template, output)
         template_env = jinja2.Environment(
             loader=jinja2.FileSystemLoader(os.path.dirname(str(template)))
@@ -107,5 +256,468 @@ def build_page(
             fh.write(template.render(releases=releases))
 
 
+def count_release(release, stats, services):
+    stats["releases"] += 1
+    stats["changes"] += len(release)
+    stats["updates"] += sum(len(s.changes) for s in release)
+    services.update(s.name for s in release)
+
+
+def release_records(release, record_type="release"):
+    """json records of a release, one per release or per service change."""
+    from .record import Commit
+
+    commit = next(Commit.from_commits([release]))
+    info = {
+        "sdk": release.commit.get("sdk"),
+        "tag": commit.tag,
+        "commit": commit.id,
+        "created": commit.created.isoformat(),
+    }
+    changes = [
+        {
+            "service": s.name,
+            "title": s.title,
+            "new": s.new,
+            "change_log": s.change_log,
+            "ops_added": s.ops_added,
+            "ops_updated": s.ops_updated,
+            "ops_changes": s.ops_changes,
+            "model_file": s.model_file,
+        }
+        for s in commit
+    ]
+    if record_type == "service":
+        for change in changes:
+            yield dict(info, **change)
+    else:
+        yield dict(info, services=changes)
+
+
+@cli.command()
+@click.option("--path", required=True, help="Path to AWS SDK git clone")
+@click.option("--from", "from_tag", required=True, help="Start Date or Tag")
+@click.option("--to", "to_tag", help="End Date or Tag, default: last tag")
+@click.option("--service", multiple=True, help="Filter changes to only these services")
+@click.option(
+    "--changes-dir", default=".changes", help="sdk release changes json dir in repo"
+)
+@click.option("--model-path", default="apis/", help="model directory prefix")
+@click.option("--model-suffix", default="normal.json", help="suffix for model files")
+@click.option(
+    "--attribute",
+    is_flag=True,
+    default=False,
+    help="Find the tag that introduced each new operation",
+)
+@click.option(
+    "--format", "output_format", type=click.Choice(["text", "json"]), default="text"
+)
+def diff(
+    path,
+    from_tag,
+    to_tag,
+    service,
+    changes_dir,
+    model_path,
+    model_suffix,
+    attribute,
+    output_format,
+):
+    """net api changes between two tags, diffing only their trees"""
+    import pygit2
+
+    from .model import ReleaseDelta
+    from .repo import CommitProcessor, TagWalker
+
+    repo = pygit2.Repository(path)
+    walker = TagWalker(repo)
+    delta_processor = CommitProcessor(
+        repo,
+        model_prefix=model_path,
+        model_suffix=model_suffix,
+        change_dir=changes_dir,
+        services=service,
+    )
+    result = walker.diff_range(from_tag, to_tag)
+    if result is None:
+        log.info("no tags between %s and %s", from_tag, to_tag or "latest")
+        return
+    _, _, commit_info, change_diff, (base, *tags) = result
+    log.info("diffing %s..%s collapsing %d tags", base, commit_info["tag"], len(tags))
+
+    # change log entries of every release in the range
+    change_log = None
+    if changes_dir:
+        delta_processor.preload_change_logs(walker.get_end_tree(to_tag))
+        change_log = delta_processor.range_change_log(tags)
+    service_changes = delta_processor.process(commit_info, change_diff, change_log)
+    delta_processor.aliases.report()
+    release = ReleaseDelta(commit_info, service_changes)
+
+    # added operation -> introducing tag, per service
+    introduced = {}
+    if attribute:
+        model_files = {d.new_file.path: str(d.new_file.id) for d in change_diff.deltas}
+        for svc_change in service_changes:
+            added = [c.op for c in svc_change if c.type == "new"]
+            paths = [
+                p for p, oid in model_files.items() if oid == svc_change.model_file
+            ]
+            if not added or not paths:
+                continue
+            history = walker.blob_history(paths[0], [base] + tags)
+            introduced[svc_change.name] = delta_processor.attribute_operations(
+                history, added
+            )
+
+    if output_format == "json":
+        from .record import encode_value
+
+        for record in release_records(release):
+            record["from"] = base
+            for svc in record["services"]:
+                svc["introduced"] = introduced.get(svc["service"], {})
+            click.echo(json.dumps(record, default=encode_value))
+        return
+
+    for record in release_records(release, "service"):
+        click.echo(
+            "%s..%s %s - %d new %d updated"
+            % (
+                base,
+                record["tag"],
+                record["service"],
+                len(record["ops_added"]),
+                len(record["ops_updated"]),
+            )
+        )
+        svc_introduced = introduced.get(record["service"], {})
+        for op in record["ops_added"]:
+            click.echo("    %-8s %s %s" % ("new", op, svc_introduced.get(op, "")))
+        for op in record["ops_updated"]:
+            click.echo("    %-8s %s" % ("updated", op))
+
+
+@cli.command()
+@click.option("--path", required=True, help="Path to AWS SDK git clone")
+@click.option("--service", required=True, help="Service name")
+@click.option("--since", help="Start Tag, exclusive")
+@click.option("--until", help="End Tag")
+@click.option(
+    "--index",
+    type=click.Path(resolve_path=True),
+    help="Path to persistent model history index",
+)
+@click.option(
+    "--diff-cache",
+    type=click.Path(resolve_path=True),
+    help="Path to persistent diff result store",
+)
+@click.option(
+    "--changes-dir", default=".changes", help="sdk release changes json dir in repo"
+)
+@click.option("--model-path", default="apis/", help="model directory prefix")
+@click.option("--model-suffix", default="normal.json", help="suffix for model files")
+@click.option(
+    "--format", "output_format", type=click.Choice(["text", "json"]), default="text"
+)
+def history(
+    path,
+    service,
+    since,
+    until,
+    index,
+    diff_cache,
+    changes_dir,
+    model_path,
+    model_suffix,
+    output_format,
+):
+    """a service's api history, diffing only the tags it changed in"""
+    import pygit2
+
+    from .cache import DiffCache
+    from .history import ModelHistory
+    from .model import ReleaseDelta
+    from .record import encode_value
+    from .repo import CommitProcessor, TagWalker, commit_dict
+
+    repo = pygit2.Repository(path)
+    walker = TagWalker(repo)
+    model_history = ModelHistory(index or ":memory:", model_path, model_suffix)
+    model_history.update(walker)
+    for tag in (since, until):
+        if tag and tag not in model_history.positions:
+            raise click.UsageError("unknown tag %s" % tag)
+
+    diff_cache = diff_cache and DiffCache(diff_cache) or None
+    delta_processor = CommitProcessor(
+        repo,
+        model_prefix=model_path,
+        model_suffix=model_suffix,
+        change_dir=changes_dir,
+        diff_cache=diff_cache,
+    )
+    if changes_dir:
+        delta_processor.preload_change_logs(walker.get_end_tree(until))
+
+    # each model path's previous blob, the state as of since to start
+    previous = {}
+    rows = model_history.service_history(service, since, until)
+    if not rows:
+        log.info("no model changes for %s", service)
+    for tag, changes in itertools.groupby(rows, key=lambda r: r[0]):
+        commit_info = commit_dict(walker.get_tag_commit("refs/tags/%s" % tag))
+        commit_info["tag"] = tag
+        service_changes = []
+        for _, model_file, blob_id in changes:
+            if model_file not in previous:
+                previous[model_file] = since and model_history.blob_at(
+                    model_file, since
+                )
+            old_id, previous[model_file] = previous[model_file], blob_id
+            if blob_id is None:
+                continue
+            svc_change = delta_processor.diff_blobs(old_id, blob_id)
+            if not svc_change:
+                continue
+            svc_change.model_file = blob_id
+            svc_change.commit = commit_info
+            service_changes.append(svc_change)
+        delta_processor.aliases.associate(
+            service_changes, delta_processor.range_change_log([tag])
+        )
+        if not service_changes:
+            continue
+        for record in release_records(ReleaseDelta(commit_info, service_changes)):
+            if output_format == "json":
+                click.echo(json.dumps(record, default=encode_value))
+                continue
+            for svc in record["services"]:
+                click.echo(
+                    "%s %s %s - %d new %d updated"
+                    % (
+                        record["created"][:10],
+                        tag,
+                        svc["service"],
+                        len(svc["ops_added"]),
+                        len(svc["ops_updated"]),
+                    )
+                )
+    # other services' change log categories are expected here
+    delta_processor.aliases.unknown.clear()
+    delta_processor.aliases.report()
+    if diff_cache:
+        diff_cache.close()
+    model_history.close()
+
+
+@cli.command()
+@click.option("--path", required=True, help="Path to AWS SDK git clone")
+@click.option(
+    "--cache",
+    required=True,
+    type=click.Path(resolve_path=True),
+    help="Path to commit cache file",
+)
+@click.option(
+    "--templates", default="templates", type=click.Path(exists=True, resolve_path=True)
+)
+@click.option("--assets", default="assets", type=click.Path(resolve_path=True))
+@click.option("--output", required=True, type=click.Path(resolve_path=True))
+@click.option("--bucket", help="S3 bucket to publish the site to")
+@click.option("--interval", type=int, default=300, help="Seconds between tag polls")
+@click.option(
+    "--fetch/--no-fetch", default=True, help="Fetch new tags from the sdk origin"
+)
+@click.option(
+    "--store", type=click.Path(resolve_path=True), help="Path to indexed change store"
+)
+@click.option(
+    "--history",
+    type=click.Path(resolve_path=True),
+    help="Path to model history index",
+)
+@click.option(
+    "--doc-engine",
+    type=click.Choice(["direct", "docutils"]),
+    default="docutils",
+    help="Operation doc renderer, direct falls back to docutils as needed",
+)
+@click.option(
+    "--minify",
+    is_flag=True,
+    default=False,
+    help="Strip whitespace and comments from published html, css and json",
+)
+@click.option(
+    "--persist-cmd",
+    help="Command run after each published build to upload the caches, "
+    "e.g. 'just cache-upload'",
+)
+def watch(
+    path,
+    cache,
+    templates,
+    assets,
+    output,
+    bucket,
+    interval,
+    fetch,
+    store,
+    history,
+    doc_engine,
+    minify,
+    persist_cmd,
+):
+    """incrementally build the site as new sdk releases are tagged"""
+    from .publisher import SitePublisher
+    from .sitebuild import Site
+
+    site = Site(
+        path, cache, templates, Path(assets), store_path=store, history_path=history
+    )
+    site.doc_engine = doc_engine
+    publisher = bucket and SitePublisher(Path(output), bucket, minify=minify) or None
+    site.watch(
+        Path(output),
+        interval,
+        publisher,
+        fetch,
+        persist_cmd and shlex.split(persist_cmd) or None,
+    )
+
+
+@cli.command()
+@click.option("--path", required=True, help="Path to AWS SDK git clone")
+@click.option("--since", help="Start Date or Tag, default: first tag")
+@click.option("--until", help="End Date or Tag, default: last tag")
+@click.option("--shards", type=int, default=4, help="Number of tag range shards")
+@click.option(
+    "--shard",
+    type=int,
+    help="Only run this shard, for running shards on separate nodes",
+)
+@click.option(
+    "--merge", is_flag=True, default=False, help="Only merge existing shard caches"
+)
+@click.option("--workers", type=int, default=1, help="Local shard processes")
+@click.option(
+    "--shard-dir",
+    required=True,
+    type=click.Path(resolve_path=True),
+    help="Directory of partial shard caches",
+)
+@click.option(
+    "--cache",
+    type=click.Path(resolve_path=True),
+    help="Commit cache the shards are merged into",
+)
+@click.option(
+    "--templates", default="templates", type=click.Path(exists=True, resolve_path=True)
+)
+@click.option(
+    "--store", type=click.Path(resolve_path=True), help="Path to indexed change store"
+)
+def backfill(
+    path,
+    since,
+    until,
+    shards,
+    shard,
+    merge,
+    workers,
+    shard_dir,
+    cache,
+    templates,
+    store,
+):
+    """rebuild the commit history in tag range shards, then merge them
+
+    with --shard only that shard is run, with --merge only existing
+    shards are merged, otherwise all shards are run locally and merged.
+    """
+    from . import backfill as sharded
+    from .sitebuild import Site
+
+    site_options = dict(
+        repo_path=path,
+        cache_path=cache or os.path.join(shard_dir, "cache.bin"),
+        template_dir=templates,
+        assets_dir=None,
+    )
+    Path(shard_dir).mkdir(parents=True, exist_ok=True)
+    if shard is not None:
+        if not 0 <= shard < shards:
+            raise click.UsageError("--shard should be between 0 and %d" % (shards - 1))
+        sharded.run_shard(site_options, since, until, shard, shards, shard_dir)
+        return
+    if cache is None:
+        raise click.UsageError("--cache is required to merge shards")
+
+    if merge:
+        paths = [sharded.shard_path(shard_dir, k, shards) for k in range(shards)]
+        missing = [str(p) for p in paths if not p.exists()]
+        if missing:
+            raise click.UsageError("missing shards: %s" % ", ".join(missing))
+    else:
+        paths = sharded.backfill(site_options, since, until, shards, shard_dir, workers)
+    site = Site(store_path=store, **site_options)
+    site.merge_shards(sharded.load_shards(paths))
+    sharded.merge_diff_caches(shard_dir, shards, site.diff_cache_path)
+
+
+@cli.command()
+@click.option(
+    "--store",
+    required=True,
+    type=click.Path(exists=True, resolve_path=True),
+    help="Path to indexed change store",
+)
+@click.option("--service", help="Service name")
+@click.option("--operation", help="Operation name")
+@click.option("--since", type=click.DateTime(), help="Start date")
+@click.option("--until", type=click.DateTime(), help="End date")
+@click.option("--days", type=int, help="Changes in the last n days")
+@click.option("--limit", type=int, help="Maximum number of releases")
+@click.option(
+    "--format", "output_format", type=click.Choice(["text", "json"]), default="text"
+)
+def query(store, service, operation, since, until, days, limit, output_format):
+    """query the change store by service, operation and date"""
+    from datetime import datetime, timedelta, timezone
+
+    from .record import Commit
+    from .store import ChangeStore
+
+    if days:
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+    # naive dates on the command line are taken as utc
+    since, until = [
+        d and d.tzinfo is None and d.replace(tzinfo=timezone.utc) or d
+        for d in (since, until)
+    ]
+    change_store = ChangeStore(store)
+    commits = change_store.commits(service, operation, since, until, limit)
+    change_store.close()
+
+    if output_format == "json":
+        click.echo(Commit.schema().dumps(commits, many=True))
+        return
+    for c in commits:
+        for s in c:
+            click.echo(
+                "%s %s %s" % (c.created.strftime("%Y-%m-%d"), c.tag, s.slug.strip())
+            )
+            ops = [("new", o) for o in s.ops_added] + [
+                ("updated", o) for o in s.ops_updated
+            ]
+            for otype, op in ops:
+                if operation and op != operation:
+                    continue
+                click.echo("    %-8s %s" % (otype, op))
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,114 @@
+from xml.sax.saxutils import escape, quoteattr
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = (
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+)
+
+
+def format_date(date):
+    """rfc 2822 date, independent of the current locale."""
+    offset = date.utcoffset()
+    zone = ""
+    if offset is not None:
+        minutes = int(offset.total_seconds()) // 60
+        zone = " %s%02d%02d" % (minutes < 0 and "-" or "+", *divmod(abs(minutes), 60))
+    return "%s, %02d %s %04d %02d:%02d:%02d%s" % (
+        DAYS[date.weekday()],
+        date.day,
+        MONTHS[date.month - 1],
+        date.year,
+        date.hour,
+        date.minute,
+        date.second,
+        zone,
+    )
+
+
+class FeedWriter(object):
+    """Streaming rss 2.0 writer.
+
+    Items are written to the file handle as they're added, matching
+    the pretty printed layout feedgen produces for the same fields,
+    without building the document tree in memory.
+    """
+
+    indent = "  "
+
+    def __init__(self, fh, title, link, self_link, description, **options):
+        self.fh = fh
+        self.title = title
+        self.link = link
+        self.self_link = self_link
+        self.description = description
+        self.options = options
+        self.count = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.end()
+
+    def element(self, depth, tag, text):
+        self.fh.write(
+            "%s<%s>%s</%s>\n" % (self.indent * depth, tag, escape(str(text)), tag)
+        )
+
+    def start(self):
+        w = self.fh.write
+        w("<?xml version='1.0' encoding='UTF-8'?>\n")
+        w(
+            '<rss xmlns:atom="http://www.w3.org/2005/Atom" '
+            'xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+            'version="2.0">\n'
+        )
+        w("%s<channel>\n" % self.indent)
+        self.element(2, "title", self.title)
+        self.element(2, "link", self.link)
+        self.element(2, "description", self.description)
+        w(
+            '%s<atom:link href=%s rel="self"/>\n'
+            % (self.indent * 2, quoteattr(self.self_link))
+        )
+        self.element(2, "docs", "http://www.rssboard.org/rss-specification")
+        if self.options.get("generator"):
+            self.element(2, "generator", self.options["generator"])
+        if self.options.get("image"):
+            w("%s<image>\n" % (self.indent * 2))
+            self.element(3, "url", self.options["image"])
+            self.element(3, "title", self.title)
+            self.element(3, "link", self.link)
+            w("%s</image>\n" % (self.indent * 2))
+        if self.options.get("language"):
+            self.element(2, "language", self.options["language"])
+        if self.options.get("build_date"):
+            self.element(2, "lastBuildDate", format_date(self.options["build_date"]))
+
+    def add_entry(self, title, link, guid, published, description=None):
+        w = self.fh.write
+        w("%s<item>\n" % (self.indent * 2))
+        self.element(3, "title", title)
+        self.element(3, "link", link)
+        if description:
+            self.element(3, "description", description)
+        w('%s<guid isPermaLink="false">%s</guid>\n' % (self.indent * 3, escape(guid)))
+        self.element(3, "pubDate", format_date(published))
+        w("%s</item>\n" % (self.indent * 2))
+        self.count += 1
+
+    def end(self):
+        self.fh.write("%s</channel>\n</rss>\n" % self.indent)
@@ -0,0 +1,144 @@
+import logging
+import sqlite3
+
+from .repo import get_model_paths, model_service_name
+
+log = logging.getLogger("apichanges.history")
+
+SCHEMA = (
+    "create table if not exists tags (tag text primary key, position integer)",
+    "create table if not exists blobs ("
+    "path text, service text, tag text, position integer, blob_id text)",
+    "create index if not exists blobs_path on blobs (path, position)",
+    "create index if not exists blobs_service on blobs (service, position)",
+)
+
+
+class ModelHistory(object):
+    """Index of model file versions across release tags.
+
+    Each model path maps to the ordered (tag, blob id) of the tags where
+    its blob changed, a deleted file is recorded with a null blob id.
+    The index is built by diffing consecutive tag trees once, and only
+    tags added since the last update are diffed after that.
+    """
+
+    def __init__(self, path, model_prefix="apis/", model_suffix="normal.json"):
+        self.path = str(path)
+        self.model_prefix = model_prefix
+        self.model_suffix = model_suffix
+        self.conn = sqlite3.connect(self.path)
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.positions = dict(self.conn.execute("select tag, position from tags"))
+
+    def select(self, path):
+        return path.startswith(self.model_prefix) and path.endswith(self.model_suffix)
+
+    def update(self, walker) -> int:
+        """index tags not yet seen, returns the count of tags added."""
+        tags = [str(t).rsplit("/", 1)[-1] for t in walker.get_tag_set()]
+        # tags are version sorted, a tag landing between indexed ones
+        # shifts positions, so reindex from the first divergence.
+        start = 0
+        while start < len(tags) and self.positions.get(tags[start], -1) == start:
+            start += 1
+        if start == len(tags):
+            return 0
+        if len(self.positions) > start:
+            log.info("model history reindexing from %s", tags[start])
+            self.conn.execute("delete from tags where position >= ?", (start,))
+            self.conn.execute("delete from blobs where position >= ?", (start,))
+
+        previous = None
+        if start:
+            previous = walker.get_tag_commit("refs/tags/%s" % tags[start - 1])
+        for position in range(start, len(tags)):
+            tag = tags[position]
+            cur = walker.get_tag_commit("refs/tags/%s" % tag)
+            if previous:
+                changes = [
+                    (d.new_file.path, d.status_char() != "D" and str(d.new_file.id))
+                    for d in walker.repo.diff(previous, cur).deltas
+                ]
+            else:
+                changes = [
+                    (p, str(cur.tree[p].id))
+                    for paths in get_model_paths(
+                        walker.repo, cur.tree, self.model_prefix, self.model_suffix
+                    ).values()
+                    for p in paths
+                ]
+            self.conn.executemany(
+                "insert into blobs values (?, ?, ?, ?, ?)",
+                [
+                    (
+                        path,
+                        model_service_name(path, self.model_prefix, self.model_suffix),
+                        tag,
+                        position,
+                        blob_id or None,
+                    )
+                    for path, blob_id in changes
+                    if self.select(path)
+                ],
+            )
+            self.conn.execute("insert into tags values (?, ?)", (tag, position))
+            previous = cur
+        self.conn.commit()
+        self.positions = dict(self.conn.execute("select tag, position from tags"))
+        log.info("model history indexed %d tags", len(tags) - start)
+        return len(tags) - start
+
+    def history(self, path):
+        """(tag, blob id) of each version of a model file, oldest first."""
+        return list(
+            self.conn.execute(
+                "select tag, blob_id from blobs where path = ? order by position",
+                (path,),
+            )
+        )
+
+    def service_history(self, service, since=None, until=None):
+        """(tag, path, blob id) where a service's model files changed.
+
+        since is exclusive and until inclusive, as with a tag walk.
+        """
+        clauses, params = ["service = ?"], [service]
+        if since is not None:
+            clauses.append("position > ?")
+            params.append(self.positions[since])
+        if until is not None:
+            clauses.append("position <= ?")
+            params.append(self.positions[until])
+        return list(
+            self.conn.execute(
+                "select tag, path, blob_id from blobs where %s order by position"
+                % " and ".join(clauses),
+                params,
+            )
+        )
+
+    def blob_at(self, path, tag):
+        """blob id of a model file as of a tag, or None if absent."""
+        row = self.conn.execute(
+            "select blob_id from blobs where path = ? and position <= ? "
+            "order by position desc limit 1",
+            (path, self.positions[tag]),
+        ).fetchone()
+        return row and row[0] or None
+
+    def models_at(self, service, tag):
+        """map of model path to blob id for a service as of a tag."""
+        models = {}
+        for path, blob_id in self.conn.execute(
+            "select path, blob_id from blobs where service = ? and position <= ? "
+            "order by position",
+            (service, self.positions[tag]),
+        ):
+            models[path] = blob_id
+        return {p: b for p, b in models.items() if b}
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,126 @@
+"""Whitespace and comment stripping for published html, css and json.
+
+Minification is conservative, content where whitespace matters or that
+holds code, ``pre``, ``textarea`` and ``script`` elements, docutils
+inline literals and css strings, passes through untouched.
+"""
+
+import json
+import re
+
+HTML_SPACE = "[ \t\n\r\f]"
+HTML_WHITESPACE = re.compile(HTML_SPACE + "+")
+# docutils inline literals are styled white-space: pre-wrap, their
+# content only holds text and span.pre word wrappers
+HTML_PRESERVE = re.compile(
+    r"(<(pre|textarea|script)\b.*?</\2%s*>"
+    r'|<span class="docutils literal">(?:[^<]|<span\b[^>]*>[^<]*</span>)*</span>)'
+    % HTML_SPACE,
+    re.S | re.I,
+)
+# conditional comments are markup for old browsers
+HTML_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.S)
+# whitespace next to these tags never renders
+BLOCK_TAGS = (
+    "address",
+    "article",
+    "aside",
+    "blockquote",
+    "body",
+    "br",
+    "dd",
+    "details",
+    "div",
+    "dl",
+    "dt",
+    "footer",
+    "form",
+    "h[1-6]",
+    "head",
+    "header",
+    "hr",
+    "html",
+    "li",
+    "link",
+    "main",
+    "meta",
+    "nav",
+    "ol",
+    "p",
+    "section",
+    "summary",
+    "table",
+    "tbody",
+    "td",
+    "th",
+    "thead",
+    "title",
+    "tr",
+    "ul",
+)
+HTML_BLOCK_SPACE = re.compile(
+    r"%s*(</?(?:%s)\b[^>]*>)%s*" % (HTML_SPACE, "|".join(BLOCK_TAGS), HTML_SPACE),
+    re.I,
+)
+
+CSS_STRING_OR_COMMENT = re.compile(
+    r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/)""", re.S
+)
+CSS_WHITESPACE = re.compile(r"\s+")
+CSS_PUNCTUATION_SPACE = re.compile(r" ?([{};,>]) ?")
+
+
+def collapse_space(match):
+    # a newline keeps lines short for diffs, and costs the same byte
+    return "\n" in match.group() and "\n" or " "
+
+
+def minify_html(text):
+    parts = HTML_PRESERVE.split(text)
+    out = []
+    # split yields text, then each preserved element and its tag name,
+    # None for inline literals
+    for idx in range(0, len(parts), 3):
+        chunk = HTML_COMMENT.sub("", parts[idx])
+        chunk = HTML_WHITESPACE.sub(collapse_space, chunk)
+        out.append(HTML_BLOCK_SPACE.sub(r"\1", chunk))
+        if idx + 1 < len(parts):
+            out.append(parts[idx + 1])
+    return "".join(out).strip()
+
+
+def minify_css(text):
+    out = []
+    rules = []
+    for idx, chunk in enumerate(CSS_STRING_OR_COMMENT.split(text)):
+        # comments drop out, except /*! license comments, strings stay
+        if idx % 2 and (not chunk.startswith("/*") or chunk.startswith("/*!")):
+            out.append(minify_css_rules("".join(rules)))
+            out.append(chunk)
+            rules = []
+        elif not idx % 2:
+            rules.append(chunk)
+    out.append(minify_css_rules("".join(rules)))
+    return "".join(out).strip()
+
+
+def minify_css_rules(text):
+    text = CSS_WHITESPACE.sub(" ", text)
+    text = CSS_PUNCTUATION_SPACE.sub(r"\1", text).replace(";}", "}")
+    # a space before a colon is a selector descendant, after one never matters
+    return text.replace(": ", ":")
+
+
+def minify_json(text):
+    return json.dumps(json.loads(text), separators=(",", ":"))
+
+
+MINIFIERS = {"html": minify_html, "css": minify_css, "json": minify_json}
+
+
+def minify_file(name, data: bytes) -> bytes:
+    """minify file content by file name, unknown types pass through."""
+    ext = name.rsplit(".", 1)[-1]
+    if ext not in MINIFIERS or ".min." in name:
+        return data
+    return MINIFIERS[ext](data.decode("utf8")).encode("utf8")
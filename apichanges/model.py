@@ -1,9 +1,7 @@
 import logging
+from collections import Counter
 
-from botocore import hooks, model, xform_name
-from botocore.docs.docstring import ClientMethodDocstring
-from docutils.core import publish_parts
-from docutils.writers.html5_polyglot import HTMLTranslator, Writer
+from botocore import model
 
 log = logging.getLogger("apichanges.model")
 
@@ -218,6 +216,9 @@ class ShapeResolver(model.ShapeResolver):
 def diff_model(new, old=None):
     new = ServiceModel(new)
     log.debug("delta diffing service:%s", new.service_name)
+    # change records only reference the summary, so the models are
+    # released as soon as the diff returns.
+    summary = ServiceSummary.from_model(new)
     if old:
         old = ServiceModel(old)
         new_methods = set(new.operation_names).difference(old.operation_names)
@@ -226,10 +227,10 @@ def diff_model(new, old=None):
 
     changes = []
     for n in new_methods:
-        changes.append(NewMethod(new, n))
+        changes.append(NewMethod(summary, n))
 
     if not old:
-        return ServiceChange(new, changes, new=True)
+        return ServiceChange(summary, changes, new=True)
 
     old_shapes = set(old.shape_names)
     modified_shapes = []
@@ -248,17 +249,43 @@ def diff_model(new, old=None):
             modified_shapes.append((s, delta))
 
     mshape_map = dict(modified_shapes)
-    for op in new.operation_names:
+    changes.extend(updated_methods(summary, operation_shapes(new), mshape_map))
+
+    if changes:
+        return ServiceChange(summary, changes)
+
+
+def operation_shapes(service):
+    for op in service.operation_names:
+        op_shape = service.operation_model(op)
+        yield (
+            op,
+            op_shape.input_shape and op_shape.input_shape.name,
+            op_shape.output_shape and op_shape.output_shape.name,
+        )
+
+
+def raw_operation_shapes(operations):
+    for op, op_shape in operations.items():
+        yield (
+            op,
+            op_shape.get("input", {}).get("shape"),
+            op_shape.get("output", {}).get("shape"),
+        )
+
+
+def updated_methods(service, op_shapes, mshape_map):
+    changes = []
+    for op, input_name, output_name in op_shapes:
         op_delta = {}
-        op_shape = new.operation_model(op)
-        if op_shape.input_shape and op_shape.input_shape.name in mshape_map:
-            op_delta["request"] = d_i = mshape_map[op_shape.input_shape.name]
-        if op_shape.output_shape and op_shape.output_shape.name in mshape_map:
-            op_delta["response"] = mshape_map[op_shape.output_shape.name]
+        if input_name in mshape_map:
+            op_delta["request"] = d_i = mshape_map[input_name]
+        if output_name in mshape_map:
+            op_delta["response"] = mshape_map[output_name]
 
         # sigh ec2 service specific hack
         if (
-            new.service_name == "ec2"
+            service.service_name == "ec2"
             and "request" in op_delta
             and "TagSpecifications" in d_i
         ):
@@ -269,10 +296,280 @@ def diff_model(new, old=None):
             continue
         if len(op_delta) == 2 and op_delta["request"] == op_delta["response"]:
             op_delta = {"both": op_delta["request"]}
-        changes.append(UpdatedMethod(new.service_name, op, op_delta))
+        changes.append(UpdatedMethod(service, op, op_delta))
+    return changes
+
+
+def shape_references(shape):
+    if shape["type"] == "structure":
+        return [m["shape"] for m in shape.get("members", {}).values()]
+    elif shape["type"] == "list":
+        return [shape["member"]["shape"]]
+    elif shape["type"] == "map":
+        return [shape["key"]["shape"], shape["value"]["shape"]]
+    return []
+
+
+def recursive_shapes(shapes, roots=None):
+    """names of shapes which are part of, or reference, a shape cycle.
+
+    if roots are given, only shapes reachable from them are considered.
+    """
+    state, recursive = {}, set()
+
+    def visit(name):
+        state[name] = "stack"
+        found = False
+        for ref in shape_references(shapes[name]):
+            if ref not in shapes:
+                continue
+            rstate = state.get(ref)
+            if rstate is None:
+                found = visit(ref) or found
+            elif rstate == "stack" or ref in recursive:
+                found = True
+        state[name] = "done"
+        if found:
+            recursive.add(name)
+        return found
+
+    for name in shapes if roots is None else roots:
+        if name not in state:
+            visit(name)
+    return recursive
+
+
+class ShapeReferenceIndex(object):
+    """Reverse reference graph of a service description.
+
+    Maps each shape to the shapes referencing it, and to the operations
+    using it as input or output, so modifications to nested shapes can
+    be propagated to the operations they affect.
+    """
+
+    def __init__(self, description):
+        self.referrers = {}
+        self.operations = {}
+        for name, shape in description.get("shapes", {}).items():
+            for ref in shape_references(shape):
+                self.referrers.setdefault(ref, set()).add(name)
+        for op, input_name, output_name in raw_operation_shapes(
+            description.get("operations", {})
+        ):
+            for shape_name in filter(None, (input_name, output_name)):
+                self.operations.setdefault(shape_name, set()).add(op)
+
+    def affected_shapes(self, shape_names):
+        """shapes transitively referencing any of shape_names, inclusive."""
+        affected = set(shape_names)
+        queue = list(affected)
+        while queue:
+            for referrer in self.referrers.get(queue.pop(), ()):
+                if referrer not in affected:
+                    affected.add(referrer)
+                    queue.append(referrer)
+        return affected
+
+
+class RawShapeDiff(object):
+    """Compare shapes directly on the model's raw ``shapes`` dicts.
+
+    Mirrors the semantics of the EqualityVisitor, DeltaVisitor and
+    TypeRepr visitors, without resolving botocore shape objects, as
+    the comparison only needs member names, enums, list members, map
+    key/values and type names.
+    """
+
+    SHAPE_KINDS = ("structure", "list", "map", "string")
+
+    def __init__(self, new_shapes, old_shapes, roots=None):
+        self.new_shapes = new_shapes
+        self.old_shapes = old_shapes
+        # results are only context free (memoizable) for shapes whose
+        # references don't lead back into the recursion stack.
+        self.recursive = recursive_shapes(new_shapes, roots)
+        self.equal_cache = {}
+        self.empty_deltas = set()
+
+    @classmethod
+    def kind(cls, shape):
+        stype = shape["type"]
+        return stype if stype in cls.SHAPE_KINDS else "shape"
+
+    def equals(self, name, other):
+        if self.kind(self.new_shapes[name]) != self.kind(self.old_shapes[other]):
+            return False
+        return self._equals(name, other, set())
+
+    def _equals(self, name, other, seen):
+        # seen tracks the new shape names on the recursion stack
+        if name in seen:
+            return True
+        if (name, other) in self.equal_cache:
+            return self.equal_cache[(name, other)]
+        seen.add(name)
+        try:
+            result = self._equals_shape(name, other, seen)
+        finally:
+            seen.remove(name)
+        if name not in self.recursive:
+            self.equal_cache[(name, other)] = result
+        return result
+
+    def _equals_shape(self, name, other, seen):
+        new, old = self.new_shapes[name], self.old_shapes[other]
+        kind = self.kind(new)
+        if kind == "structure":
+            # type change to struct
+            if self.kind(old) != "structure":
+                return True
+            members, old_members = new.get("members", {}), old.get("members", {})
+            if set(members).difference(old_members):
+                return False
+            for m, ref in members.items():
+                if not self._equals(ref["shape"], old_members[m]["shape"], seen):
+                    return False
+            return True
+        # the visitors raise on other type changes, we treat them as modified.
+        elif kind != self.kind(old):
+            return False
+        elif kind == "list":
+            return self._equals(new["member"]["shape"], old["member"]["shape"], seen)
+        elif kind == "map":
+            return self._equals(
+                new["key"]["shape"], old["key"]["shape"], seen
+            ) and self._equals(new["value"]["shape"], old["value"]["shape"], seen)
+        elif kind == "string":
+            return new.get("enum", []) == old.get("enum", [])
+        return self.kind(old) == "shape" and name == other
+
+    def delta(self, name, other):
+        return self._delta(name, other, set())
+
+    def _delta(self, name, other, seen):
+        if name in seen:
+            return ()
+        # only empty deltas are cached, non empty ones are returned
+        # as new objects as callers may mutate them.
+        if (name, other) in self.empty_deltas:
+            return ()
+        seen.add(name)
+        try:
+            result = self._delta_shape(name, other, seen)
+        finally:
+            seen.remove(name)
+        if not result and name not in self.recursive:
+            self.empty_deltas.add((name, other))
+        return result
+
+    def _delta_shape(self, name, other, seen):
+        new, old = self.new_shapes[name], self.old_shapes[other]
+        kind = self.kind(new)
+        if kind == "structure":
+            if self.kind(old) != "structure":
+                return self.type_repr(name)
+            members, old_members = new.get("members", {}), old.get("members", {})
+            added = set(members).difference(old_members)
+            modified = {a: self.type_repr(members[a]["shape"]) for a in added}
+            for m, ref in members.items():
+                if m in added:
+                    continue
+                md = self._delta(ref["shape"], old_members[m]["shape"], seen)
+                if md:
+                    modified[m] = md
+            return modified
+        elif kind != "shape" and kind != self.kind(old):
+            return self.type_repr(name)
+        elif kind == "list":
+            return self._delta(new["member"]["shape"], old["member"]["shape"], seen)
+        elif kind == "map":
+            return self._delta(new["value"]["shape"], old["value"]["shape"], seen)
+        elif kind == "string":
+            return set(new.get("enum", [])).difference(old.get("enum", []))
+        return []
+
+    def type_repr(self, name, seen=None):
+        seen = set() if seen is None else seen
+        if name in seen:
+            return ()
+        seen.add(name)
+        try:
+            shape = self.new_shapes[name]
+            kind = self.kind(shape)
+            if kind == "structure":
+                return {
+                    k: self.type_repr(ref["shape"], seen)
+                    for k, ref in shape.get("members", {}).items()
+                }
+            elif kind == "list":
+                return [self.type_repr(shape["member"]["shape"], seen)]
+            elif kind == "map":
+                return {
+                    self.type_repr(shape["key"]["shape"], seen): self.type_repr(
+                        shape["value"]["shape"], seen
+                    )
+                }
+            elif kind == "string":
+                if shape.get("enum"):
+                    return " | ".join(shape["enum"])
+                return "string"
+            return shape["type"]
+        finally:
+            seen.remove(name)
+
+
+# bump when differ output changes, to invalidate persisted diff results.
+DIFF_VERSION = 1
+
+
+def diff_raw_model(new, old=None):
+    """diff_model equivalent operating on the raw service description.
+
+    Produces the same NewMethod/UpdatedMethod deltas as the visitor
+    based diff_model, only the ServiceModel wrapper is instantiated
+    for the service summary. Only operation shapes reachable from a
+    changed raw shape definition are compared.
+    """
+    service = ServiceSummary.from_model(ServiceModel(new))
+    log.debug("raw delta diffing service:%s", service.service_name)
+    # new methods are reported in model order, rather than set order.
+    operations = new.get("operations", {})
+    old_operations = old and old.get("operations", {}) or {}
+    new_methods = [op for op in operations if op not in old_operations]
+
+    changes = []
+    for n in new_methods:
+        changes.append(NewMethod(service, n))
+
+    if not old:
+        return ServiceChange(service, changes, new=True)
+
+    # only operation input/output shapes that reference a shape whose
+    # raw definition changed can compare as modified.
+    new_shapes, old_shapes = new.get("shapes", {}), old.get("shapes", {})
+    changed = [s for s, shape in new_shapes.items() if old_shapes.get(s) != shape]
+    index = ShapeReferenceIndex(new)
+    candidates = [
+        s
+        for s in index.affected_shapes(changed).intersection(index.operations)
+        if s in old_shapes
+    ]
+    differ = RawShapeDiff(new_shapes, old_shapes, candidates)
+    modified_shapes = []
+    for s in candidates:
+        if differ.equals(s, s):
+            continue
+        delta = differ.delta(s, s)
+        if delta:
+            modified_shapes.append((s, delta))
+
+    mshape_map = dict(modified_shapes)
+    changes.extend(
+        updated_methods(service, raw_operation_shapes(operations), mshape_map)
+    )
 
     if changes:
-        return ServiceChange(new, changes)
+        return ServiceChange(service, changes)
 
 
 class ReleaseDelta(object):
@@ -300,6 +597,35 @@ class ReleaseDelta(object):
         )
 
 
+class ServiceSummary(object):
+    """Stand in for a ServiceModel on change records, carrying only
+    the service name and the metadata used for titles and change log
+    association.
+    """
+
+    __slots__ = ("service_name", "metadata")
+
+    METADATA = (
+        "endpointPrefix",
+        "serviceAbbreviation",
+        "serviceFullName",
+        "serviceId",
+        "signingName",
+        "uid",
+    )
+
+    def __init__(self, service_name, metadata):
+        self.service_name = service_name
+        self.metadata = metadata
+
+    @classmethod
+    def from_model(cls, service):
+        return cls(
+            service.service_name,
+            {k: service.metadata[k] for k in cls.METADATA if k in service.metadata},
+        )
+
+
 class ServiceChange(object):
     def __init__(self, service, changes, new=False):
         self.new = new
@@ -352,33 +678,34 @@ class ServiceChange(object):
         "Budgets": "savingsplans",
     }
 
-    def associate_logs(self, change_log):
+    def log_aliases(self):
+        """change log categories this service may be listed under,
+        in order of preference."""
+        metadata = self.service.metadata
         candidates = (
-            self.LOG_ID_MAP.get(self.service.metadata.get("serviceId")),
-            self.service.metadata.get("serviceId"),
-            self.service.metadata.get("signingName"),
-            self.service.metadata.get("endpointPrefix"),
+            self.LOG_ID_MAP.get(metadata.get("serviceId")),
+            metadata.get("serviceId"),
+            metadata.get("signingName"),
+            metadata.get("endpointPrefix"),
             # sso oidc
-            self.service.metadata.get("serviceAbbreviation", "").replace(" ", "-"),
+            metadata.get("serviceAbbreviation", "").replace(" ", "-"),
             "-".join(
-                [
-                    c
-                    for c in self.service.metadata.get("uid", "").split("-")
-                    if not c.isdigit()
-                ]
+                [c for c in metadata.get("uid", "").split("-") if not c.isdigit()]
             ),
-            self.service.metadata.get("endpointPrefix", "").replace("-", ""),
-            self.service.metadata.get("serviceId", "").replace(" ", ""),
-            self.service.metadata.get("serviceId", "") + "service",
+            metadata.get("endpointPrefix", "").replace("-", ""),
+            metadata.get("serviceId", "").replace(" ", ""),
+            metadata.get("serviceId", "") + "service",
             self.service.service_name.replace("-", "") + "service",
-            self.service.metadata.get("serviceId", "").replace(" ", "-"),
+            metadata.get("serviceId", "").replace(" ", "-"),
         )
+        return tuple(c.lower() for c in candidates if c)
 
+    def associate_logs(self, change_log):
         if not change_log:
             return
         logs = ()
-        for c in filter(None, candidates):
-            logs = change_log.get(c.lower(), ())
+        for c in self.log_aliases():
+            logs = change_log.get(c, ())
             if logs:
                 break
         if not logs:
@@ -388,6 +715,82 @@ class ServiceChange(object):
         self.logs = logs
 
 
+class ChangeLogAliases(object):
+    """Index of change log categories to the services they may refer to.
+
+    Aliases are registered once per service name and metadata, as a
+    service may have several api versions with differing metadata. A
+    commit's change log categories are resolved with one lookup per
+    category, each service taking its most preferred category, so
+    associating a service change is a single dict hit. Misses are
+    aggregated and reported once per run.
+    """
+
+    def __init__(self):
+        # alias -> {service key: preference}
+        self.aliases = {}
+        self.registered = set()
+        self.missing = Counter()
+        self.unknown = Counter()
+
+    @staticmethod
+    def service_key(svc_change):
+        # aliases derive from the summary metadata fields
+        metadata = svc_change.service.metadata
+        return (svc_change.name,) + tuple(
+            metadata.get(k) for k in ServiceSummary.METADATA
+        )
+
+    def register(self, svc_change):
+        key = self.service_key(svc_change)
+        if key in self.registered:
+            return key
+        for rank, alias in enumerate(svc_change.log_aliases()):
+            self.aliases.setdefault(alias, {}).setdefault(key, rank)
+        self.registered.add(key)
+        return key
+
+    def resolve(self, change_log):
+        """map of service key to its change log category."""
+        best = {}
+        for category in change_log:
+            services = self.aliases.get(category)
+            if not services:
+                self.unknown[category] += 1
+                continue
+            for key, rank in services.items():
+                if key not in best or rank < best[key][0]:
+                    best[key] = (rank, category)
+        return {key: category for key, (rank, category) in best.items()}
+
+    def associate(self, service_changes, change_log):
+        keys = [self.register(s) for s in service_changes]
+        if not change_log:
+            return
+        resolved = self.resolve(change_log)
+        for key, s in zip(keys, service_changes):
+            category = resolved.get(key)
+            if category is None:
+                self.missing[s.name] += 1
+                continue
+            s.logs = change_log[category]
+
+    def report(self):
+        if self.missing:
+            log.warning(
+                "no change log entry found for %d service changes: %s",
+                sum(self.missing.values()),
+                ", ".join("%s(%d)" % i for i in sorted(self.missing.items())),
+            )
+        if self.unknown:
+            log.warning(
+                "change log categories not associated with any service: %s",
+                ", ".join("%s(%d)" % i for i in sorted(self.unknown.items())),
+            )
+        self.missing.clear()
+        self.unknown.clear()
+
+
 class Change(object):
     @property
     def service_name(self):
@@ -395,6 +798,11 @@ class Change(object):
 
     def render_operation(self):
         # try and reuse botocore's sphinx doc infrastructure.
+        from botocore import hooks, xform_name
+        from botocore.docs.docstring import ClientMethodDocstring
+
+        from .rst import render_docutils
+
         method_doc = ClientMethodDocstring(
             operation_model=self.op,
             method_name=self.op.name,
@@ -403,17 +811,7 @@ class Change(object):
             example_prefix="client.%s" % xform_name(self.op.name),
             include_signature=False,
         )
-        return self._render_docutils(method_doc)
-
-    def _render_docutils(self, method_doc):
-        method_writer = Writer()
-        method_writer.translator_class = HTMLTranslator
-        parts = publish_parts(
-            str(method_doc),
-            settings_overrides={"report_level": 4},
-            writer=method_writer,
-        )
-        return parts["fragment"]
+        return render_docutils(str(method_doc))
 
 
 class NewMethod(Change):
@@ -439,5 +837,5 @@ class UpdatedMethod(Change):
 
     def __repr__(self):
         return ("Updated Method: service:{} method:{} " "delta:{}").format(
-            self.service, self.op, self.delta
+            self.service_name, self.op, self.delta
         )
@@ -1,14 +1,20 @@
 import contextlib
 import gzip
+import hashlib
 import logging
 import mimetypes
 import os
 import shutil
 import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import boto3
 
+from .assets import ASSET_TYPES, is_fingerprinted
+from .minify import minify_file
+
 log = logging.getLogger("apichanges.publish")
 
 
@@ -21,22 +27,91 @@ def temp_dir():
         shutil.rmtree(d)
 
 
+def stage_file(source: Path, target: Path, compress, minify):
+    """stage one site file, returning its type and its size as found,
+    minified and staged."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    ext = source.name.rsplit(".", 1)[-1]
+    if not compress:
+        shutil.copy2(str(source), str(target))
+        size = source.stat().st_size
+        return ext, size, size, size
+    data = source.read_bytes()
+    size = len(data)
+    if minify:
+        data = minify_file(source.name, data)
+    # no timestamp in the gzip header, unchanged files stage identically
+    with target.open("wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as fh:
+        fh.write(data)
+    return ext, size, len(data), target.stat().st_size
+
+
 class SitePublisher(object):
 
     compress_exts = set(("js", "css", "json", "html"))
+    # fingerprinted assets never change under a name, everything else
+    # (pages, feeds, search data) is revalidated shortly.
+    immutable_cache_control = "public, max-age=31536000, immutable"
+    cache_control = "public, max-age=300"
 
-    def __init__(self, site_dir: Path, s3_bucket, s3_prefix=""):
+    def __init__(
+        self, site_dir: Path, s3_bucket, s3_prefix="", minify=False, workers=None
+    ):
         self.site_dir = site_dir
         self.bucket = s3_bucket
         self.prefix = s3_prefix.rstrip("/")
+        # strip whitespace and comments from html, css and json
+        self.minify = minify
+        # staging processes, None for one per cpu
+        self.workers = workers
 
-    def publish(self):
+    def publish(self, paths=None):
+        """upload the site, or only the given site relative paths."""
         client = boto3.client("s3")
+        published = self.get_published_assets(client)
+        paths = self.get_unpublished(published, paths)
         with temp_dir() as staging:
-            self.prepare_staging(staging)
-            self.transfer_staging(client, staging)
+            self.prepare_staging(staging, paths)
+            self.transfer_staging(client, staging, published)
+
+    def get_files(self, paths=None):
+        if paths is not None:
+            for p in paths:
+                yield self.site_dir / p
+            return
+        for dirpath, dirnames, files in os.walk(self.site_dir):
+            for f in files:
+                yield Path(dirpath) / f
+
+    def get_key(self, path):
+        return ("%s/%s" % (self.prefix, Path(path).as_posix())).lstrip("/")
+
+    def get_published_assets(self, client):
+        """key to etag of the assets in the bucket, listed per asset dir."""
+        published = {}
+        paginator = client.get_paginator("list_objects_v2")
+        for atype in ASSET_TYPES:
+            for page in paginator.paginate(
+                Bucket=self.bucket, Prefix=self.get_key(atype) + "/"
+            ):
+                for obj in page.get("Contents", ()):
+                    published[obj["Key"]] = obj["ETag"].strip('"')
+        return published
 
-    def transfer_staging(self, client, staging):
+    def get_unpublished(self, published, paths=None):
+        """site relative paths to upload, fingerprinted assets already
+        in the bucket are skipped as their content can't have changed."""
+        paths = [f.relative_to(self.site_dir) for f in self.get_files(paths)]
+        unpublished = [
+            p
+            for p in paths
+            if not is_fingerprinted(p.name) or self.get_key(p) not in published
+        ]
+        if len(unpublished) != len(paths):
+            log.info("skip %d published assets", len(paths) - len(unpublished))
+        return unpublished
+
+    def transfer_staging(self, client, staging, published=None):
         for dirpath, dirnames, files in os.walk(staging):
             dirpath = Path(dirpath)
             for f in files:
@@ -49,36 +124,68 @@ class SitePublisher(object):
                 if ext == "rss":
                     params["ContentDisposition"] = "inline"
                 params["ContentType"], _ = mimetypes.guess_type(f)
-                key = str(self.prefix / tf).lstrip("/")
+                params["CacheControl"] = (
+                    is_fingerprinted(f)
+                    and self.immutable_cache_control
+                    or self.cache_control
+                )
+                key = self.get_key(tf)
+                # single part uploads have the md5 of the content as etag
+                if (
+                    published
+                    and published.get(key) == hashlib.md5(sf.read_bytes()).hexdigest()
+                ):
+                    log.debug("unchanged %s", key)
+                    continue
                 log.info("upload %s", key)
                 client.upload_file(
                     str(sf), Bucket=self.bucket, Key=key, ExtraArgs=params
                 )
 
-    def prepare_staging(self, staging):
-        tf_count = 0
+    def prepare_staging(self, staging, paths=None):
+        files = list(self.get_files(paths))
+        args = [
+            (
+                f,
+                staging / f.relative_to(self.site_dir),
+                f.name.rsplit(".", 1)[-1] in self.compress_exts,
+                self.minify,
+            )
+            for f in files
+        ]
+        if self.workers != 1 and len(args) > 1:
+            with ProcessPoolExecutor(self.workers) as executor:
+                results = list(executor.map(stage_file, *zip(*args)))
+        else:
+            results = [stage_file(*a) for a in args]
+
         tf_size = 0
-        for dirpath, dirnames, files in os.walk(self.site_dir):
-            dirpath = Path(dirpath)
-            stage_dir = staging / dirpath.relative_to(self.site_dir)
-            for f in files:
-                ext = f.rsplit(".", 1)[-1]
-                tf = stage_dir / f
-                f = dirpath / f
-                tf.parent.mkdir(parents=True, exist_ok=True)
-                if ext in self.compress_exts:
-                    with gzip.open(tf, "w") as fh:
-                        fh.write(f.read_bytes())
-                    osize = f.stat().st_size
-                    csize = tf.stat().st_size
-                    log.debug(
-                        "compressed %s -> %s -> %s (%0.0f%%)"
-                        % (dirpath / f, osize, csize, csize / float(osize) * 100)
-                    )
-                    tf_size += csize
-                else:
-                    shutil.copy2(str(f), str(tf))
-                    tf_size += f.stat().st_size
-                tf_count += 1
+        counts, sizes, minified_sizes = Counter(), Counter(), Counter()
+        for f, (ext, size, minified, staged) in zip(files, results):
+            if ext in self.compress_exts:
+                log.debug(
+                    "compressed %s -> %s -> %s (%0.0f%%)"
+                    % (f, size, staged, staged / float(size or 1) * 100)
+                )
+            tf_size += staged
+            counts[ext] += 1
+            sizes[ext] += size
+            minified_sizes[ext] += minified
 
-        log.info("prepared stage %d files %d size" % (tf_count, tf_size))
+        if self.minify:
+            for ext in sorted(counts):
+                if sizes[ext] == minified_sizes[ext]:
+                    continue
+                saved = sizes[ext] - minified_sizes[ext]
+                log.info(
+                    "minified %d %s files %d -> %d saved %d (%0.1f%%)"
+                    % (
+                        counts[ext],
+                        ext,
+                        sizes[ext],
+                        minified_sizes[ext],
+                        saved,
+                        saved / float(sizes[ext]) * 100,
+                    )
+                )
+        log.info("prepared stage %d files %d size" % (len(results), tf_size))
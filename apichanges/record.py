@@ -1,12 +1,31 @@
-from datetime import datetime
+import json
+import re
+import sys
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass
 from dataclasses_json import dataclass_json
 from typing import List, Dict, Any
 
+# compact binary cache codec, a msgpack array of commits prefixed by
+# magic bytes, bump the version on record layout changes.
+CODEC_MAGIC = b"APCH"
+CODEC_VERSION = 1
+
 
 @dataclass_json
 @dataclass
 class ServiceChange:
+    __slots__ = (
+        "name",
+        "title",
+        "change_log",
+        "new",
+        "ops_added",
+        "ops_updated",
+        "ops_changes",
+        "model_file",
+    )
+
     name: str
     title: str
     change_log: str
@@ -16,6 +35,14 @@ class ServiceChange:
     ops_changes: Dict[str, Any]
     model_file: str
 
+    def __post_init__(self):
+        # service names, titles and operation names repeat across history
+        self.name = sys.intern(self.name)
+        self.title = sys.intern(self.title)
+        self.ops_added = [sys.intern(o) for o in self.ops_added]
+        self.ops_updated = [sys.intern(o) for o in self.ops_updated]
+        self.ops_changes = {sys.intern(k): v for k, v in self.ops_changes.items()}
+
     @classmethod
     def from_changes(cls, service_changes):
         for s in service_changes:
@@ -57,6 +84,8 @@ class ServiceChange:
 @dataclass_json
 @dataclass
 class Commit:
+    __slots__ = ("id", "tag", "created", "service_changes")
+
     id: str
     tag: str
     created: datetime
@@ -83,3 +112,259 @@ class Commit:
                 created=r.commit["created_at"],
                 service_changes=list(ServiceChange.from_changes(r)),
             )
+
+
+@dataclass_json
+@dataclass
+class ServiceHistory:
+    """a service's release history, commit ids newest first."""
+
+    __slots__ = (
+        "name",
+        "title",
+        "rank",
+        "model_file",
+        "commits",
+        "dates",
+        "ops_added",
+        "ops_updated",
+    )
+
+    name: str
+    title: str
+    # position within its latest commit, orders services updated together
+    rank: int
+    # model blob as of the latest commit
+    model_file: str
+    commits: List[str]
+    dates: List[float]
+    ops_added: int
+    ops_updated: int
+
+    @property
+    def count(self):
+        return len(self.commits)
+
+    @property
+    def latest(self) -> float:
+        return self.dates[0]
+
+    @property
+    def latest_date(self) -> datetime:
+        return datetime.fromtimestamp(self.dates[0], timezone.utc)
+
+    def add(self, commit: Commit, svc_change: ServiceChange, rank: int):
+        created = commit.created.timestamp()
+        # new commits are typically the newest, so search from the front
+        idx = 0
+        while idx < len(self.dates) and self.dates[idx] >= created:
+            idx += 1
+        self.commits.insert(idx, commit.id)
+        self.dates.insert(idx, created)
+        if idx == 0:
+            self.title = svc_change.title
+            self.rank = rank
+            self.model_file = svc_change.model_file
+        self.ops_added += svc_change.count_new
+        self.ops_updated += svc_change.count_updated
+
+
+def doc_summary(documentation: str, size: int = 240) -> str:
+    """first sentence of a model's html documentation as plain text."""
+    text = re.sub(r"<fullname>.*?</fullname>", "", documentation or "", flags=re.S)
+    text = " ".join(re.sub(r"<[^>]+>", " ", text).split())
+    text = re.sub(r" ([.,;:])", r"\1", text)
+    sentence = text.split(". ", 1)[0]
+    if len(sentence) > size:
+        sentence = sentence[: size - 3].rsplit(" ", 1)[0] + "..."
+    elif sentence and sentence != text and not sentence.endswith("."):
+        sentence += "."
+    return sentence
+
+
+@dataclass_json
+@dataclass
+class ServiceMetadata:
+    """template facing service details, as of its latest model blob."""
+
+    __slots__ = ("name", "title", "service_id", "summary", "icon", "model_file")
+
+    name: str
+    title: str
+    service_id: str
+    summary: str
+    icon: str
+    model_file: str
+
+    @classmethod
+    def from_model(cls, history: ServiceHistory, data: Dict[str, Any], icon: str):
+        metadata = data.get("metadata", {})
+        return cls(
+            name=history.name,
+            title=history.title,
+            service_id=metadata.get("serviceId", ""),
+            summary=doc_summary(data.get("documentation", "")),
+            icon=icon,
+            model_file=history.model_file,
+        )
+
+
+class ServiceIndex:
+    """Per service release history and metadata, updated with each
+    load's new commits.
+
+    Persisted next to the commit cache with the count of commits it
+    covers, a mismatch against the loaded history means it's stale
+    and should be rebuilt.
+    """
+
+    version = 2
+
+    def __init__(self, services=None, count=0, metadata=None):
+        self.services = services or {}
+        self.count = count
+        self.metadata = metadata or {}
+
+    def __len__(self):
+        return len(self.services)
+
+    def __iter__(self):
+        return iter(self.services.values())
+
+    def __contains__(self, name):
+        return name in self.services
+
+    def __getitem__(self, name) -> ServiceHistory:
+        return self.services[name]
+
+    @classmethod
+    def from_commits(cls, commits: List[Commit]):
+        index = cls()
+        index.update(commits)
+        return index
+
+    def update(self, commits: List[Commit]):
+        for c in commits:
+            for rank, s in enumerate(c.service_changes):
+                if s.name not in self.services:
+                    self.services[s.name] = ServiceHistory(
+                        name=s.name,
+                        title=s.title,
+                        rank=rank,
+                        model_file=s.model_file,
+                        commits=[],
+                        dates=[],
+                        ops_added=0,
+                        ops_updated=0,
+                    )
+                self.services[s.name].add(c, s, rank)
+            self.count += 1
+
+    def stale_metadata(self) -> List[ServiceHistory]:
+        """services whose metadata predates their latest model blob."""
+        return [
+            h
+            for h in self.services.values()
+            if h.name not in self.metadata
+            or self.metadata[h.name].model_file != h.model_file
+        ]
+
+    def ordered(self) -> List[ServiceHistory]:
+        """services most recently updated first."""
+        return sorted(self.services.values(), key=lambda s: (-s.latest, s.rank))
+
+    def dumps(self) -> bytes:
+        return json.dumps(
+            {
+                "version": self.version,
+                "count": self.count,
+                "services": [s.to_dict() for s in self.services.values()],
+                "metadata": [m.to_dict() for m in self.metadata.values()],
+            }
+        ).encode("utf8")
+
+    @classmethod
+    def loads(cls, data: bytes):
+        data = json.loads(data.decode("utf8"))
+        if data.get("version") != cls.version:
+            return cls()
+        return cls(
+            {s["name"]: ServiceHistory.from_dict(s) for s in data["services"]},
+            data["count"],
+            {m["name"]: ServiceMetadata.from_dict(m) for m in data["metadata"]},
+        )
+
+
+def encode_value(obj):
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError("unserializable value %r" % (obj,))
+
+
+def dumps_compact(commits: List[Commit]) -> bytes:
+    import msgpack
+
+    records = []
+    for c in commits:
+        offset = c.created.utcoffset()
+        records.append(
+            [
+                c.id,
+                c.tag,
+                c.created.timestamp(),
+                offset and int(offset.total_seconds()) or 0,
+                [
+                    [
+                        s.name,
+                        s.title,
+                        s.change_log,
+                        s.new,
+                        s.ops_added,
+                        s.ops_updated,
+                        s.ops_changes,
+                        s.model_file,
+                    ]
+                    for s in c.service_changes
+                ],
+            ]
+        )
+    return CODEC_MAGIC + msgpack.packb(
+        [CODEC_VERSION, records], default=encode_value, use_bin_type=True
+    )
+
+
+def loads_compact(data: bytes) -> List[Commit]:
+    import msgpack
+
+    if not data.startswith(CODEC_MAGIC):
+        raise ValueError("not a compact commit cache")
+    version, records = msgpack.unpackb(data[len(CODEC_MAGIC) :], raw=False)
+    if version != CODEC_VERSION:
+        raise ValueError("unsupported commit cache version %s" % version)
+    timezones = {}
+    commits = []
+    for cid, tag, created, offset, services in records:
+        if offset not in timezones:
+            timezones[offset] = timezone(timedelta(seconds=offset))
+        commits.append(
+            Commit(
+                id=cid,
+                tag=tag,
+                created=datetime.fromtimestamp(created, timezones[offset]),
+                service_changes=[ServiceChange(*s) for s in services],
+            )
+        )
+    return commits
+
+
+def dumps(commits: List[Commit], compact: bool = False) -> bytes:
+    if compact:
+        return dumps_compact(commits)
+    return Commit.schema().dumps(commits, many=True).encode("utf8")
+
+
+def loads(data: bytes) -> List[Commit]:
+    """load commits from either the json or compact cache format."""
+    if data.startswith(CODEC_MAGIC):
+        return loads_compact(data)
+    return Commit.schema().loads(data.decode("utf8"), many=True)
@@ -1,8 +1,10 @@
 import bisect
+import hashlib
 import json
 import logging
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from distutils.version import LooseVersion
 from functools import lru_cache
@@ -11,10 +13,13 @@ import pygit2
 from dateutil.parser import parse as parse_date
 from dateutil.tz import tzoffset, tzutc
 
-from .model import diff_model
+from .model import DIFF_VERSION, ChangeLogAliases, diff_raw_model
 
 log = logging.getLogger("apichanges.repo")
 
+MODEL_VERSION = re.compile(r"-\d{4}-\d{2}-\d{2}$")
+GIT_EMPTY_FILE = "0" * 40
+
 
 def commit_date(commit):
     tzinfo = tzoffset(None, timedelta(minutes=commit.author.offset))
@@ -34,6 +39,54 @@ def commit_dict(commit, committed_date=None):
     )
 
 
+def model_service_name(path, prefix="", suffix=""):
+    """service name of a model file path.
+
+    handles both flat (apis/ec2-2016-11-15.normal.json) and nested
+    (botocore/data/ec2/2016-11-15/service-2.json) model layouts.
+    """
+    name = path[len(prefix) : len(path) - len(suffix)].strip("/").split("/", 1)[0]
+    return MODEL_VERSION.sub("", name.rstrip("."))
+
+
+def get_model_paths(repo, tree, prefix, suffix):
+    """map of service name to model file paths within a git tree."""
+    paths = {}
+
+    def walk(tree, path):
+        for entry in tree:
+            epath = path + entry.name
+            # only trees are looked up, model blobs are never read
+            if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+                dpath = epath + "/"
+                if dpath.startswith(prefix) or prefix.startswith(dpath):
+                    walk(repo[entry.id], dpath)
+            elif epath.startswith(prefix) and epath.endswith(suffix):
+                paths.setdefault(model_service_name(epath, prefix, suffix), []).append(
+                    epath
+                )
+
+    walk(tree, "")
+    return paths
+
+
+def canonical_hash(model):
+    """digest of a model's content independent of its file formatting."""
+    return hashlib.sha1(
+        json.dumps(model, sort_keys=True, separators=(",", ":")).encode("utf8")
+    ).hexdigest()
+
+
+def parse_change_log(data):
+    """release change log entries keyed by lower cased category."""
+    change_log = {}
+    for n in json.loads(data.decode("utf8")):
+        change_log.setdefault(n["category"].strip("`").lower(), []).append(
+            n["description"]
+        )
+    return change_log
+
+
 class CommitProcessor(object):
     def __init__(
         self,
@@ -43,24 +96,74 @@ class CommitProcessor(object):
         change_dir=None,
         services=(),
         debug=False,
+        differ=diff_raw_model,
+        diff_cache=None,
+        diff_version=DIFF_VERSION,
+        canonical=False,
     ):
         self.repo = repo
         self.model_prefix = model_prefix
         self.model_suffix = model_suffix
         self.change_dir = change_dir
-        self.services = services
+        self.services = frozenset(services)
         self.debug = debug
+        self.differ = differ
+        self.diff_cache = diff_cache
+        self.diff_version = diff_version
+        # key diff results on model content rather than blob ids
+        self.canonical = canonical
+        self.content_hashes = {}
+        self.path_services = {}
+        self.aliases = ChangeLogAliases()
+        # change dir path to release change log, when preloaded
+        self.change_logs = None
 
-    def load_change_log(self, fid):
-        change_log = {}
-        data = json.loads(self.repo[fid].read_raw().decode("utf8"))
-        for n in data:
-            change_log.setdefault(n["category"].strip("`").lower(), []).append(
-                n["description"]
+    def select(self, path):
+        """is path a model file of a service we're processing."""
+        if not (
+            path.startswith(self.model_prefix) and path.endswith(self.model_suffix)
+        ):
+            return False
+        if not self.services:
+            return True
+        if path not in self.path_services:
+            self.path_services[path] = model_service_name(
+                path, self.model_prefix, self.model_suffix
             )
-        return change_log
+        return self.path_services[path] in self.services
+
+    def get_service_paths(self, tree):
+        return get_model_paths(self.repo, tree, self.model_prefix, self.model_suffix)
+
+    def load_change_log(self, fid):
+        return parse_change_log(self.repo[fid].read_raw())
+
+    def preload_change_logs(self, tree, workers=0):
+        """read every release change log in the change dir of tree.
+
+        Lookups are then served by version, including releases whose
+        change log only landed in a later tag.
+        """
+        try:
+            change_tree = self.repo[tree[self.change_dir].id]
+        except KeyError:
+            log.warning("change log dir %s not found", self.change_dir)
+            self.change_logs = {}
+            return
+        names, blobs = [], []
+        for entry in change_tree:
+            if entry.name.endswith(".json"):
+                names.append(os.path.join(self.change_dir, entry.name))
+                blobs.append(self.repo[entry.id].read_raw())
+        if workers:
+            with ProcessPoolExecutor(workers) as executor:
+                logs = list(executor.map(parse_change_log, blobs, chunksize=64))
+        else:
+            logs = list(map(parse_change_log, blobs))
+        self.change_logs = dict(zip(names, logs))
+        log.info("preloaded %d change logs", len(self.change_logs))
 
-    def process(self, commit, change_diff):
+    def process(self, commit, change_diff, change_log=None):
         if self.debug:
             log.debug(
                 (
@@ -75,40 +178,28 @@ class CommitProcessor(object):
             )
         service_changes = []
 
-        change_path = change_log = None
+        change_path = None
         if self.change_dir:
             change_path = os.path.join(
                 self.change_dir, "%s.json" % commit["tag"].lstrip("v")
             )
 
-        # Get file map so we can ensure change log first.
         file_map = {d.new_file.path: d for d in change_diff.deltas}
-        if change_path and change_path in file_map:
+        model_deltas = [(f, d) for f, d in file_map.items() if self.select(f)]
+
+        # a given change log, ie. merged across a tag range, takes precedence
+        if change_log is None and self.change_logs is not None:
+            change_log = self.change_logs.get(change_path)
+        # only read the change log if a selected service changed.
+        elif change_log is None and model_deltas and change_path in file_map:
             change_log = self.load_change_log(file_map.get(change_path).new_file.id)
 
-        for dpath, d in [
-            (f, d)
-            for f, d in file_map.items()
-            if f.startswith(self.model_prefix) and f.endswith(self.model_suffix)
-        ]:
-            if self.services:
-                found = False
-                for s in self.services:
-                    if s in dpath:
-                        found = True
-                if not found:
-                    continue
+        for dpath, d in model_deltas:
             if self.debug:
                 log.debug(
                     "api model change {} change: {}".format(dpath, d.status_char())
                 )
-            if d.status_char() == "A":
-                new = json.loads(self.repo[d.new_file.id].read_raw().decode("utf8"))
-                old = None
-            elif d.status_char() == "M":
-                new = json.loads(self.repo[d.new_file.id].read_raw().decode("utf8"))
-                old = json.loads(self.repo[d.old_file.id].read_raw().decode("utf8"))
-            else:
+            if d.status_char() not in ("A", "M"):
                 log.warning(
                     "service file unknown change commit:%s file:%s change:%s",
                     commit["commit_id"],
@@ -117,7 +208,7 @@ class CommitProcessor(object):
                 )
                 continue
             try:
-                svc_change = diff_model(new, old)
+                svc_change = self.diff(d)
             except Exception:
                 log.error("commit:%s error processing %s", commit["commit_id"], dpath)
                 raise
@@ -128,11 +219,99 @@ class CommitProcessor(object):
 
             svc_change.model_file = str(d.new_file.id)
             svc_change.commit = commit
-            svc_change.associate_logs(change_log)
-            log.info(svc_change)
             service_changes.append(svc_change)
+
+        self.aliases.associate(service_changes, change_log)
+        for svc_change in service_changes:
+            log.info(svc_change)
+        if self.diff_cache is not None:
+            self.diff_cache.flush()
         return service_changes
 
+    def diff(self, delta):
+        return self.diff_blobs(
+            delta.status_char() == "M" and str(delta.old_file.id) or None,
+            str(delta.new_file.id),
+        )
+
+    def diff_blobs(self, old_id, new_id):
+        """diff two model blobs, old_id is None for an added model."""
+        models = {}
+        # added models are keyed on git's null blob id
+        old_key, new_key = old_id or GIT_EMPTY_FILE, new_id
+        if self.canonical:
+            new_key = self.content_hash(new_id, models)
+            if old_id:
+                old_key = self.content_hash(old_id, models)
+        if self.diff_cache is not None:
+            found, svc_change = self.diff_cache.get(old_key, new_key, self.diff_version)
+            if found:
+                return svc_change
+        new = models.get(new_id) or self.load_model(new_id)
+        old = None
+        if old_id:
+            old = models.get(old_id) or self.load_model(old_id)
+        svc_change = self.differ(new, old)
+        if self.diff_cache is not None:
+            self.diff_cache.put(old_key, new_key, self.diff_version, svc_change)
+        return svc_change
+
+    def range_change_log(self, tags):
+        """merged change log entries of the given release tags."""
+        if self.change_logs is None:
+            return None
+        change_log = {}
+        for t in tags:
+            path = os.path.join(self.change_dir, "%s.json" % t.lstrip("v"))
+            for category, entries in self.change_logs.get(path, {}).items():
+                change_log.setdefault(category, []).extend(entries)
+        return change_log
+
+    def attribute_operations(self, history, operations):
+        """map of operation to the tag that introduced it.
+
+        history is a file's (tag, blob id) versions, each operation is
+        bisected to the first version that has it, parsing only the
+        versions probed.
+        """
+        op_sets = {}
+
+        def has_op(idx, op):
+            if idx not in op_sets:
+                model = self.load_model(history[idx][1])
+                op_sets[idx] = frozenset(model.get("operations", ()))
+            return op in op_sets[idx]
+
+        introduced = {}
+        for op in operations:
+            lo, hi = 0, len(history) - 1
+            if not history or not has_op(hi, op):
+                continue
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if has_op(mid, op):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            introduced[op] = history[lo][0]
+        return introduced
+
+    def load_model(self, blob_id):
+        return json.loads(self.repo[blob_id].read_raw().decode("utf8"))
+
+    def content_hash(self, blob_id, models):
+        """canonical hash of a model blob, models collects any loaded."""
+        content_hash = self.content_hashes.get(blob_id)
+        if content_hash is None and self.diff_cache is not None:
+            content_hash = self.diff_cache.get_content_hash(blob_id)
+        if content_hash is None:
+            models[blob_id] = self.load_model(blob_id)
+            content_hash = canonical_hash(models[blob_id])
+            if self.diff_cache is not None:
+                self.diff_cache.put_content_hash(blob_id, content_hash)
+        self.content_hashes[blob_id] = content_hash
+        return content_hash
+
 
 class TagWalker(object):
     """Iter commits and diffs on a git repo.
@@ -142,26 +321,28 @@ class TagWalker(object):
     def __init__(self, repo):
         self.repo = repo
 
-    def walk(self, since, until=None):
+    def walk(self, since, until=None, reverse=False):
         """paramertized iterator.
 
         since|until: either a date string or a tag
 
         if given a date resolve to the nearest tag. until
         defaults to last tag. tags are sorted as version
-        numbers.
+        numbers, reverse walks them newest first.
         """
         tags = self.get_tag_set()
         start = self.get_target_tag(tags, since)
         end = self.get_target_tag(tags, until, end=True)
 
-        if start == end:
-            log.debug("walker exit start == end")
+        if start is None or tags.index(start) > tags.index(end):
+            log.debug("walker exit no tags in range")
             return
 
-        for idx, t in enumerate(
-            tags[tags.index(start) : tags.index(end) + 1], tags.index(start)
-        ):
+        indexes = range(tags.index(start), tags.index(end) + 1)
+        if reverse:
+            indexes = reversed(indexes)
+        for idx in indexes:
+            t = tags[idx]
             previous = self.get_tag_commit(tags[idx - 1])
             cur = self.get_tag_commit(tags[idx])
             change_diff = self.repo.diff(previous, cur)
@@ -170,6 +351,77 @@ class TagWalker(object):
             log.debug("walking tag: %s date:%s" % (t, info["created_at"]))
             yield previous, cur, info, change_diff
 
+    def diff_range(self, since, until=None):
+        """diff of the endpoint trees of a walk, collapsing the tags between.
+
+        returns the same (previous, cur, info, diff) as a walk step along
+        with the base tag and the tags the walk would have visited.
+        """
+        tags = self.get_tag_set()
+        start = self.get_target_tag(tags, since)
+        end = self.get_target_tag(tags, until, end=True)
+        if start is None or tags.index(start) > tags.index(end):
+            return None
+        # the first tag has nothing before it, so it serves as the base
+        base = max(tags.index(start) - 1, 0)
+        if base == tags.index(end):
+            log.debug("diff range has no tags after base %s", end)
+            return None
+        previous = self.get_tag_commit(tags[base])
+        cur = self.get_tag_commit(end)
+        info = commit_dict(cur)
+        info["tag"] = str(end).rsplit("/", 1)[-1]
+        walked = [str(t).rsplit("/", 1)[-1] for t in tags[base : tags.index(end) + 1]]
+        return previous, cur, info, self.repo.diff(previous, cur), walked
+
+    def shard_ranges(self, since, until=None, count=1):
+        """split a walk into count contiguous (since, until) tag ranges.
+
+        a walk diffs each tag against its predecessor, so each range
+        starts from the last tag of the range before it. walking every
+        range visits the same tags as a single walk.
+        """
+        tags = self.get_tag_set()
+        start = self.get_target_tag(tags, since)
+        end = self.get_target_tag(tags, until, end=True)
+        if start is None or tags.index(start) > tags.index(end):
+            return []
+        # the first tag has no predecessor, it's only a base to diff from
+        first, last = max(tags.index(start), 1), tags.index(end)
+        if first > last:
+            return []
+        size = last - first + 1
+        count = max(1, min(count, size))
+        bounds = [first - 1 + (size * k) // count for k in range(count + 1)]
+        names = [str(t).rsplit("/", 1)[-1] for t in tags]
+        return [(names[bounds[k]], names[bounds[k + 1]]) for k in range(count)]
+
+    def blob_history(self, path, tags):
+        """(tag, blob id) of each version of a file across tags.
+
+        only tags where the file changed are kept, read by tree lookups
+        without diffing.
+        """
+        history = []
+        for t in tags:
+            try:
+                oid = self.get_tag_commit("refs/tags/%s" % t).tree[path].id
+            except KeyError:
+                continue
+            if not history or history[-1][1] != oid:
+                history.append((t, oid))
+        return history
+
+    def get_tag_refs(self):
+        return frozenset(
+            r for r in self.repo.listall_references() if r.startswith("refs/tags/")
+        )
+
+    def refresh(self):
+        """drop cached tag lookups, ie. after new tags have been fetched."""
+        self.get_tag_set.cache_clear()
+        self.get.cache_clear()
+
     def resolve(self, target):
         if target:
             try:
@@ -186,6 +438,11 @@ class TagWalker(object):
         cur = self.get_tag_commit(tag)
         return (commit_dict(cur), self.repo.diff(prev, cur))
 
+    def get_end_tree(self, until=None):
+        """tree of the tag a walk until the given target would end on."""
+        tags = self.get_tag_set()
+        return self.get_tag_commit(self.get_target_tag(tags, until, end=True)).tree
+
     def get_tag_commit(self, tag):
         return self.repo.lookup_reference(str(tag)).peel()
 
@@ -200,7 +457,8 @@ class TagWalker(object):
             indexer = end and bisect.bisect_left or bisect.bisect_right
             idx = indexer(tags, LooseVersion("refs/tags/%s" % target))
             if idx == len(tags):
-                return tags[-1]
+                # no tags after a start target
+                return end and tags[-1] or None
             return tags[idx]
 
         # date linear traversal from recent to older
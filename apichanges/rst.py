@@ -0,0 +1,634 @@
+"""Direct html rendering of the restructuredtext botocore generates.
+
+Operation docs only use a small part of restructuredtext, paragraphs,
+bullet and field lists, block quotes, literal blocks, admonitions and
+basic inline markup. Rendering those straight to html avoids building
+and transforming a docutils document per operation. The output matches
+the html5 writer of the installed docutils release exactly (the pinned
+0.15 through current releases), any construct outside that subset
+raises UnsupportedMarkup so callers can fall back to docutils.
+
+Inline markup recognition reuses the docutils inliner patterns, so
+start and end string rules and standalone uri detection stay in step
+with the docutils release installed.
+"""
+
+import itertools
+import re
+from types import SimpleNamespace
+
+from docutils import __version_info__ as docutils_version
+from docutils.languages import en
+from docutils.parsers.rst import roles
+from docutils.parsers.rst.languages import en as rst_en
+from docutils.parsers.rst.states import Body, Inliner
+from docutils.utils import (
+    column_width,
+    escape2null,
+    punctuation_chars,
+    unescape,
+    urischemes,
+)
+
+
+class UnsupportedMarkup(Exception):
+    """markup the direct renderer doesn't handle."""
+
+
+ADMONITIONS = (
+    "attention",
+    "caution",
+    "danger",
+    "error",
+    "hint",
+    "important",
+    "note",
+    "tip",
+    "warning",
+)
+
+BLOCK_PATTERNS = [
+    (name, re.compile(Body.patterns[name])) for name in Body.initial_transitions
+]
+DIRECTIVE = re.compile(r"\.\. +(%s) ?::( +|$)" % "|".join(ADMONITIONS))
+QUOTE_CHAR = re.compile(Body.pats["nonalphanum7bit"])
+# a block quote line starting an attribution
+ATTRIBUTION = re.compile("(---?(?!-)|—) *(?=[^ \n])")
+# docutils reads vertical whitespace as spaces
+VERTICAL_WHITESPACE = re.compile("[\v\f]")
+
+HTML_ESCAPES = {
+    ord("&"): "&amp;",
+    ord("<"): "&lt;",
+    ord('"'): "&quot;",
+    ord(">"): "&gt;",
+    ord("@"): "&#64;",
+}
+ATTRIBUTE_WHITESPACE = re.compile("[\n\r\t\v\f]")
+WORDS_AND_SPACES = re.compile(r"[^ \n]+| +|\n")
+IN_WORD_WRAP_POINT = re.compile(r".+\W\W.+|[-?].+")
+
+LINE_LENGTH_LIMIT = 10000
+MARKUP_CHARS = frozenset("*`|_")
+
+# the html5 writer wraps admonitions in aside and marks field name
+# colons from docutils 0.18, and from 0.19 problematic markup whose
+# message is filtered out is written as plain text.
+ADMONITION_TAG = docutils_version >= (0, 18) and "aside" or "div"
+FIELD_COLON = docutils_version >= (0, 18) and '<span class="colon">:</span>' or ""
+PROBLEMATIC_AS_TEXT = docutils_version >= (0, 19)
+# 0.18 numbers automatic ids per element type, earlier releases share one
+# counter across the document
+TYPED_IDS = docutils_version >= (0, 18)
+
+_inliner = None
+
+
+def get_patterns():
+    global _inliner
+    if _inliner is None:
+        _inliner = Inliner()
+        _inliner.init_customizations(
+            SimpleNamespace(
+                character_level_inline_markup=False,
+                pep_references=False,
+                rfc_references=False,
+            )
+        )
+    return _inliner.patterns
+
+
+def encode(text):
+    return text.translate(HTML_ESCAPES)
+
+
+def render(source):
+    """render restructuredtext to the docutils html5 fragment."""
+    if "\x00" in source:
+        raise UnsupportedMarkup("null character")
+    lines = [
+        line.rstrip()
+        for line in VERTICAL_WHITESPACE.sub(" ", source.expandtabs(8)).splitlines()
+    ]
+    if any(len(line) > LINE_LENGTH_LIMIT for line in lines):
+        # docutils renders nothing past an error for overlong lines
+        raise UnsupportedMarkup("line length limit")
+    blocks = BlockParser(lines).parse()
+    # a leading field list becomes document info in a full document
+    if blocks and blocks[0][0] == "fields":
+        raise UnsupportedMarkup("docinfo")
+    out = []
+    HTMLWriter(out).blocks(blocks)
+    return "".join(out)
+
+
+def get_indented(lines, start, block_indent=None, first_indent=None):
+    """port of docutils StringList.get_indented.
+
+    returns the dedented block, its indent and the index past the
+    block. docutils only warns when a block doesn't end on a blank line,
+    below the reporting threshold, so that isn't tracked.
+    """
+    indent = block_indent
+    end = start
+    if block_indent is not None and first_indent is None:
+        first_indent = block_indent
+    if first_indent is not None:
+        end += 1
+    last = len(lines)
+    while end < last:
+        line = lines[end]
+        if line and (
+            line[0] != " " or (block_indent is not None and line[:block_indent].strip())
+        ):
+            break
+        stripped = line.lstrip()
+        if stripped and block_indent is None:
+            line_indent = len(line) - len(stripped)
+            indent = line_indent if indent is None else min(indent, line_indent)
+        end += 1
+    block = lines[start:end]
+    if first_indent is not None and block:
+        block[0] = block[0][first_indent:]
+    if indent:
+        skip = first_indent is not None and 1 or 0
+        block[skip:] = [line[indent:] for line in block[skip:]]
+    return block, indent or 0, end
+
+
+def strip_top(block):
+    while block and not block[0].strip():
+        block = block[1:]
+    return block
+
+
+class BlockParser:
+    """body element parsing, mirroring the docutils rst state machine."""
+
+    def __init__(self, lines, match_titles=True, ids=None):
+        self.lines = lines
+        # section titles are only recognized at the top level
+        self.match_titles = match_titles
+        # the document's element id counter, shared with nested parsers
+        self.ids = ids if ids is not None else itertools.count(1)
+
+    def parse(self):
+        lines = self.lines
+        blocks = []
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if not line:
+                i += 1
+                continue
+            if line[0] == " ":
+                i = self.block_quote(i, blocks)
+                continue
+            for kind, pattern in BLOCK_PATTERNS:
+                match = pattern.match(line)
+                if match:
+                    break
+            if kind == "bullet":
+                i = self.bullet_list(i, blocks)
+            elif kind == "field_marker":
+                i = self.field_list(i, blocks)
+            elif kind == "explicit_markup":
+                i = self.admonition(i, blocks)
+            elif kind == "text" or self.short_line(i, kind):
+                i = self.paragraph(i, blocks)
+            else:
+                raise UnsupportedMarkup(kind)
+        return blocks
+
+    def nested(self, block):
+        return BlockParser(block, match_titles=False, ids=self.ids).parse()
+
+    def short_line(self, i, kind):
+        """whether a punctuation line, like a lone ``::``, reads as text."""
+        if kind != "line":
+            return False
+        if self.match_titles:
+            # a short transition marker needs a blank line after it
+            return len(self.lines[i]) < 4 and not (
+                i + 1 < len(self.lines) and self.lines[i + 1]
+            )
+        return self.lines[i] == "::"
+
+    def block_quote(self, i, blocks):
+        block, _, end = get_indented(self.lines, i)
+        block = strip_top(block)
+        previous = ""
+        for line in block:
+            if not previous and ATTRIBUTION.match(line):
+                raise UnsupportedMarkup("attribution")
+            previous = line
+        blocks.append(("quote", self.nested(block)))
+        return end
+
+    def list_item(self, i, indent):
+        if self.lines[i][indent:]:
+            block, _, end = get_indented(self.lines, i, block_indent=indent)
+        else:
+            block, _, end = get_indented(self.lines, i, first_indent=indent)
+        block = strip_top(block)
+        return block, end
+
+    def next_line(self, i):
+        while i < len(self.lines) and not self.lines[i]:
+            i += 1
+        return i
+
+    def bullet_list(self, i, blocks):
+        bullet = self.lines[i][0]
+        pattern = BLOCK_PATTERNS[0][1]
+        items = []
+        while True:
+            match = pattern.match(self.lines[i])
+            block, end = self.list_item(i, match.end())
+            if not block:
+                raise UnsupportedMarkup("empty list item")
+            items.append(self.nested(block))
+            i = self.next_line(end)
+            if i < len(self.lines) and self.lines[i][0] == bullet:
+                if pattern.match(self.lines[i]):
+                    continue
+            break
+        blocks.append(("list", items))
+        return end
+
+    def field_list(self, i, blocks):
+        pattern = dict(BLOCK_PATTERNS)["field_marker"]
+        fields = []
+        while True:
+            match = pattern.match(self.lines[i])
+            name = match.group()[1:]
+            name = name[: name.rfind(":")]
+            block, _, end = get_indented(self.lines, i, first_indent=match.end())
+            block = strip_top(block)
+            fields.append((inline(name, self.ids), block and self.nested(block) or []))
+            i = self.next_line(end)
+            if i < len(self.lines) and pattern.match(self.lines[i]):
+                continue
+            break
+        blocks.append(("fields", fields))
+        return end
+
+    def admonition(self, i, blocks):
+        match = DIRECTIVE.match(self.lines[i])
+        if not match:
+            raise UnsupportedMarkup("explicit markup")
+        block, _, end = get_indented(self.lines, i, first_indent=match.end())
+        if block and not block[0].strip():
+            block = block[1:]
+        while block and not block[-1].strip():
+            block = block[:-1]
+        if not block or block[0].startswith(":"):
+            raise UnsupportedMarkup("directive options")
+        blocks.append(("admonition", match.group(1), self.nested(block)))
+        return end
+
+    def paragraph(self, i, blocks):
+        lines = self.lines
+        end = i + 1
+        while end < len(lines) and lines[end]:
+            if lines[end][0] == " ":
+                # definition list or unexpected indentation
+                raise UnsupportedMarkup("indentation")
+            end += 1
+        if end > i + 1 and BLOCK_PATTERNS[-2][1].match(lines[i + 1]):
+            # docutils reads a short underline under a longer line as text
+            underline = lines[i + 1]
+            if len(underline) >= 4 or column_width(lines[i]) <= len(underline):
+                raise UnsupportedMarkup("section")
+        data = "\n".join(lines[i:end]).rstrip()
+        if not re.search(r"(?<!\\)(\\\\)*::$", data):
+            blocks.append(("p", inline(data, self.ids)))
+            return end
+        if len(data) > 2:
+            if data[-3] in " \n":
+                text = data[:-3].rstrip()
+            else:
+                text = data[:-1]
+            blocks.append(("p", inline(text, self.ids)))
+        block, _, end = get_indented(lines, end)
+        block = strip_top(block)
+        while block and not block[-1].strip():
+            block = block[:-1]
+        if block:
+            blocks.append(("pre", "\n".join(block)))
+            return end
+        return self.quoted_literal_block(end, blocks)
+
+    def quoted_literal_block(self, i, blocks):
+        """an unindented literal block, each line starting with the same
+        punctuation character. without one docutils only warns."""
+        lines = self.lines
+        i = self.next_line(i)
+        if i == len(lines) or not QUOTE_CHAR.match(lines[i]):
+            return i
+        end = i + 1
+        while end < len(lines) and lines[end][:1] == lines[i][0]:
+            end += 1
+        blocks.append(("pre", "\n".join(lines[i:end])))
+        return end
+
+
+def inline(text, ids):
+    """render inline markup to html, following docutils Inliner.parse."""
+    patterns = get_patterns()
+    remaining = escape2null(text)
+    out = []
+    unprocessed = []
+    # every start-string and reference end has one of these
+    if not MARKUP_CHARS.intersection(remaining):
+        implicit_inline(remaining, out)
+        return "".join(out)
+    while remaining:
+        match = patterns.initial.search(remaining)
+        if not match:
+            break
+        groups = match.groupdict()
+        if groups["start"] in ("*", "**", "``"):
+            before, html, remaining = inline_obj(match, groups["start"], ids)
+        elif groups["backquote"]:
+            before, html, remaining = interpreted_or_phrase_ref(match, ids)
+        else:
+            # references by name, footnotes, substitutions and targets
+            raise UnsupportedMarkup(
+                "inline %s" % (groups["start"] or groups["refend"] or groups["fnend"])
+            )
+        unprocessed.append(before)
+        if html:
+            implicit_inline("".join(unprocessed), out)
+            out.append(html)
+            unprocessed = []
+    implicit_inline("".join(unprocessed) + remaining, out)
+    return "".join(out)
+
+
+def quoted_start(match):
+    string = match.string
+    start = match.start()
+    if start == 0:
+        return False
+    try:
+        poststart = string[match.end()]
+    except IndexError:
+        return True
+    return punctuation_chars.match_chars(string[start - 1], poststart)
+
+
+INLINE_TAGS = {"*": "em", "**": "strong"}
+
+
+def inline_obj(match, start_string, ids):
+    patterns = get_patterns()
+    string = match.string
+    matchstart = match.start("start")
+    matchend = match.end("start")
+    if quoted_start(match):
+        return string[:matchend], "", string[matchend:]
+    end_pattern = {
+        "*": patterns.emphasis,
+        "**": patterns.strong,
+        "``": patterns.literal,
+    }[start_string]
+    endmatch = end_pattern.search(string[matchend:])
+    if not (endmatch and endmatch.start(1)):
+        return problematic(string, matchstart, matchend, ids)
+    text = endmatch.string[: endmatch.start(1)]
+    textend = matchend + endmatch.end(1)
+    if start_string == "``":
+        html = literal(unescape(text, True))
+    else:
+        tag = INLINE_TAGS[start_string]
+        html = "<%s>%s</%s>" % (tag, encode(unescape(text)), tag)
+    return string[:matchstart], html, string[textend:]
+
+
+def problematic(string, matchstart, matchend, ids):
+    """markup docutils can't resolve, like an unterminated start-string.
+
+    docutils marks it problematic with a warning or error, below the
+    reporting threshold the message is dropped and the source kept as
+    text, older releases still link it to the dropped message.
+    """
+    text = encode(unescape(string[matchstart:matchend], True))
+    if not PROBLEMATIC_AS_TEXT:
+        if TYPED_IDS:
+            idx = next(ids)
+            refs = ("system-message-%d" % idx, "problematic-%d" % idx)
+        else:
+            refs = ("id%d" % next(ids), "id%d" % next(ids))
+        text = '<a href="#%s"><span class="problematic" id="%s">%s</span></a>' % (
+            refs + (text,)
+        )
+    return string[:matchstart], text, string[matchend:]
+
+
+def literal(text):
+    out = ['<span class="docutils literal">']
+    for token in WORDS_AND_SPACES.findall(text.replace("\n", " ")):
+        if token.strip() and IN_WORD_WRAP_POINT.search(token):
+            out.append('<span class="pre">%s</span>' % encode(token))
+        else:
+            out.append(encode(token))
+    out.append("</span>")
+    return "".join(out)
+
+
+def interpreted_or_phrase_ref(match, ids):
+    patterns = get_patterns()
+    string = match.string
+    matchstart = match.start("backquote")
+    matchend = match.end("backquote")
+    rolestart = match.start("role")
+    role = match.group("role")[1:-1]
+    if not role and quoted_start(match):
+        return string[:matchend], "", string[matchend:]
+    endmatch = patterns.interpreted_or_phrase_ref.search(string[matchend:])
+    if not (endmatch and endmatch.start(1)):
+        return problematic(string, matchstart, matchend, ids)
+    textend = matchend + endmatch.end()
+    if endmatch.group("role"):
+        if role:
+            # both a prefix and suffix role
+            return problematic(string, rolestart, textend, ids)
+        role = endmatch.group("suffix")[1:-1]
+    escaped = endmatch.string[: endmatch.start(1)]
+    rawsource = unescape(string[matchstart:textend], True)
+    if rawsource[-1:] == "_":
+        if role:
+            return problematic(string, rolestart, textend, ids)
+        return string[:matchstart], phrase_ref(escaped), string[textend:]
+    if not role:
+        # default role, title reference
+        return (
+            string[:rolestart],
+            "<cite>%s</cite>" % encode(unescape(escaped)),
+            string[textend:],
+        )
+    if role.lower() in rst_en.roles or role.lower() in roles._role_registry:
+        raise UnsupportedMarkup("interpreted text role")
+    # sphinx roles, like ref, are unknown to docutils
+    return problematic(string, rolestart, textend, ids)
+
+
+def phrase_ref(escaped):
+    patterns = get_patterns()
+    match = patterns.embedded_link.search(escaped)
+    if not match:
+        raise UnsupportedMarkup("reference without target")
+    text = escaped[: match.start(0)]
+    aliastext = match.group(2)
+    if aliastext.endswith("_") and not (
+        unescape(aliastext, True).endswith(r"\_") or patterns.uri.match(aliastext)
+    ):
+        raise UnsupportedMarkup("indirect reference")
+    alias_parts = [
+        part
+        for chunk in match.group(2).split("\x00 ")
+        for part in chunk.split("\x00\n")
+    ]
+    alias = " ".join("".join(part.split()) for part in alias_parts)
+    alias = unescape(alias)
+    if patterns.email.match(alias):
+        alias = "mailto:" + alias
+    if alias.endswith(r"\_"):
+        alias = alias[:-2] + "_"
+    if not text:
+        text = alias
+    return reference(alias, text)
+
+
+def reference(refuri, text):
+    return '<a class="reference external" href="%s">%s</a>' % (
+        encode(ATTRIBUTE_WHITESPACE.sub(" ", refuri)),
+        encode(unescape(text)),
+    )
+
+
+def implicit_inline(text, out):
+    """standalone uris and email addresses, per docutils implicit_inline."""
+    if not text:
+        return
+    # uris need a scheme separator and email addresses an at sign
+    match = ("@" in text or ":" in text) and get_patterns().uri.search(text)
+    if match and (
+        not match.group("scheme") or match.group("scheme").lower() in urischemes.schemes
+    ):
+        implicit_inline(text[: match.start()], out)
+        whole = match.group("whole")
+        scheme = match.group("email") and "mailto:" or ""
+        out.append(reference(scheme + unescape(whole), whole))
+        implicit_inline(text[match.end() :], out)
+        return
+    out.append(encode(unescape(text)))
+
+
+class HTMLWriter:
+    """write parsed blocks as the docutils html5 writer would."""
+
+    def __init__(self, out):
+        self.out = out
+        self.compact_simple = False
+
+    def blocks(self, blocks, in_item=False):
+        for block in blocks:
+            kind = block[0]
+            if kind == "p":
+                self.out.append("<p>%s</p>" % block[1])
+                if not (in_item and len(blocks) == 1):
+                    self.out.append("\n")
+            elif kind == "list":
+                self.bullet_list(block)
+            elif kind == "fields":
+                self.field_list(block)
+            elif kind == "quote":
+                self.out.append("<blockquote>\n")
+                self.blocks(block[1])
+                self.out.append("</blockquote>\n")
+            elif kind == "pre":
+                self.out.append(
+                    '<pre class="literal-block">%s</pre>\n' % encode(block[1])
+                )
+            elif kind == "admonition":
+                self.out.append(
+                    '<%s class="admonition %s">\n'
+                    '<p class="admonition-title">%s</p>\n'
+                    % (ADMONITION_TAG, block[1], encode(en.labels[block[1]]))
+                )
+                self.blocks(block[2])
+                self.out.append("</%s>\n" % ADMONITION_TAG)
+
+    def bullet_list(self, block):
+        old_compact_simple = self.compact_simple
+        self.compact_simple = is_simple(block)
+        if self.compact_simple and not old_compact_simple:
+            self.out.append('<ul class="simple">\n')
+        else:
+            self.out.append("<ul>\n")
+        for item in block[1]:
+            self.out.append("<li>")
+            self.blocks(item, in_item=True)
+            self.out.append("</li>\n")
+        self.out.append("</ul>\n")
+        self.compact_simple = old_compact_simple
+
+    def field_list(self, block):
+        if is_simple(block):
+            self.out.append('<dl class="field-list simple">\n')
+        else:
+            self.out.append('<dl class="field-list">\n')
+        for name, body in block[1]:
+            self.out.append("<dt>%s%s</dt>\n<dd>" % (name, FIELD_COLON))
+            if not body:
+                self.out.append("<p></p>")
+            self.blocks(body)
+            self.out.append("</dd>\n")
+        self.out.append("</dl>\n")
+
+
+def is_simple(block):
+    """docutils SimpleListChecker, an item holds at most a paragraph and
+    a nested list, and nested lists are simple too."""
+    if block[0] == "list":
+        items = block[1]
+    elif block[0] == "fields":
+        items = [body for _, body in block[1]]
+    else:
+        return False
+    for item in items:
+        children = list(item)
+        if children and children[0][0] == "p" and children[-1][0] in ("list", "fields"):
+            nested = children.pop()
+            if not is_simple(nested):
+                return False
+        if len(children) > 1:
+            return False
+        if children and children[0][0] != "p" and not is_simple(children[0]):
+            return False
+    return True
+
+
+def render_html(source):
+    """render directly, falling back to docutils for unsupported markup."""
+    try:
+        return render(source)
+    except UnsupportedMarkup:
+        return render_docutils(source)
+
+
+def render_docutils(source):
+    """render through the docutils publisher, the reference output."""
+    from docutils.core import publish_parts
+    from docutils.writers.html5_polyglot import HTMLTranslator, Writer
+
+    method_writer = Writer()
+    method_writer.translator_class = HTMLTranslator
+    parts = publish_parts(
+        source,
+        settings_overrides={"report_level": 4},
+        writer=method_writer,
+    )
+    return parts["fragment"]
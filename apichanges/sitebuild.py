@@ -1,29 +1,27 @@
+import bisect
 import itertools
 import json
 import logging
 import operator
 import os
-import shutil
+import subprocess
+import sys
 import time
-from collections import Counter
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Optional
 
-import arrow
-import jinja2
-import pygit2
-from botocore import hooks, xform_name
-from botocore.docs.docstring import ClientMethodDocstring
 from dateutil.tz import tzutc
-from docutils.core import publish_parts
-from docutils.writers.html5_polyglot import HTMLTranslator, Writer
-from feedgen.feed import FeedGenerator
 
-from .icons import get_icon, get_icon_style
-from .model import ReleaseDelta, ServiceModel
-from .record import Commit, ServiceChange  # noqa
-from .repo import CommitProcessor, TagWalker
+from . import record
+from .assets import copy_assets
+from .icons import ICON_SERVICE_MAP, get_icon, get_icon_style
+from .record import Commit, ServiceChange, ServiceIndex, ServiceMetadata  # noqa
+
+# botocore, docutils, arrow, jinja2 and pygit2 are imported
+# within the build stage that uses them to keep startup light.
 
 log = logging.getLogger("awschanges.site")
 
@@ -37,40 +35,119 @@ class DateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def bisect_create_age(commits: List[Commit], days: int) -> int:
-    marker_date = datetime.now().astimezone(tzutc()).replace(
+def age_marker(days: int) -> datetime:
+    return datetime.now().astimezone(tzutc()).replace(
         hour=0, minute=0, second=0, microsecond=0
     ) - timedelta(days=days)
 
-    for idx, c in enumerate(commits):
-        if marker_date > c.created:
-            break
-    return idx
+
+def bisect_create_age(commits: List[Commit], days: int) -> int:
+    """count of leading (newest first) commits created within days."""
+    marker_date = age_marker(days)
+    lo, hi = 0, len(commits)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if commits[mid].created < marker_date:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
 
 
 def bisect_month(commits: List[Commit], month: datetime) -> int:
-    for idx, c in enumerate(commits):
-        if (c.created.year, c.created.month) == (month.year, month.month):
-            continue
-        return idx - 1
+    """index of the last (newest first) commit created in or after month."""
+    key = (month.year, month.month)
+    lo, hi = 0, len(commits)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if (commits[mid].created.year, commits[mid].created.month) < key:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo - 1
 
 
 def group_by_date(
     commits: List[Commit], year: bool = False, month: bool = False
 ) -> List[Commit]:
-
     if year:
-        key_func = lambda c: c.created.year  # noqa
+        return Timeline(commits).years()
     elif month:
-        key_func = lambda c: (c.created.year, c.created.month)  # noqa
-    else:
-        raise SyntaxError("one of month or year should be specified")
+        return Timeline(commits).months()
+    raise SyntaxError("one of month or year should be specified")
 
-    # itertools group by seems flaky..
-    groups = {}
-    for c in commits:
-        groups.setdefault(key_func(c), []).append(c)
-    return groups
+
+class Timeline:
+    """Commits newest first with a parallel array of negated timestamps.
+
+    Date windows are bisected on the timestamps, and month and year
+    buckets are computed once as offsets into the commit list until the
+    next insert.
+    """
+
+    def __init__(self, commits: List[Commit] = ()):
+        self.commits = sorted(commits, key=operator.attrgetter("created"), reverse=True)
+        self.keys = [-c.created.timestamp() for c in self.commits]
+        self.ids = {c.id: c for c in self.commits}
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.commits)
+
+    def __iter__(self):
+        return iter(self.commits)
+
+    def insert(self, commits: List[Commit]):
+        for c in commits:
+            key = -c.created.timestamp()
+            idx = bisect.bisect_left(self.keys, key)
+            self.keys.insert(idx, key)
+            self.commits.insert(idx, c)
+            self.ids[c.id] = c
+        self.buckets = {}
+
+    def get(self, commit_id: str) -> Optional[Commit]:
+        return self.ids.get(commit_id)
+
+    def offset(self, when: datetime) -> int:
+        """count of commits created at or after when."""
+        return bisect.bisect_right(self.keys, -when.timestamp())
+
+    def since(self, when: datetime) -> List[Commit]:
+        return self.commits[: self.offset(when)]
+
+    def between(self, start: datetime, end: datetime) -> List[Commit]:
+        """commits created within start and end inclusive."""
+        return self.commits[
+            bisect.bisect_left(self.keys, -end.timestamp()) : self.offset(start)
+        ]
+
+    def age(self, days: int) -> List[Commit]:
+        return self.since(age_marker(days))
+
+    def offsets(self, year: bool = False):
+        """map of (year, month) or year to a (start, end) commit offset."""
+        if year not in self.buckets:
+            if year:
+                key_func = lambda c: c.created.year  # noqa
+            else:
+                key_func = lambda c: (c.created.year, c.created.month)  # noqa
+            offsets = {}
+            for idx, c in enumerate(self.commits):
+                key = key_func(c)
+                offsets[key] = (offsets.get(key, (idx,))[0], idx + 1)
+            self.buckets[year] = offsets
+        return self.buckets[year]
+
+    def month(self, year: int, month: int) -> List[Commit]:
+        start, end = self.offsets().get((year, month), (0, 0))
+        return self.commits[start:end]
+
+    def months(self):
+        return {k: self.commits[s:e] for k, (s, e) in self.offsets().items()}
+
+    def years(self):
+        return {k: self.commits[s:e] for k, (s, e) in self.offsets(True).items()}
 
 
 def group_by_service(commits: List[Commit]):
@@ -110,29 +187,107 @@ def sizeof_fmt(num, suffix="B"):
     return "%.1f %s" % (num, suffix)
 
 
+def peak_rss() -> int:
+    """peak resident set size of the process in bytes."""
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return sys.platform == "darwin" and rss or rss * 1024
+
+
+class ModelCache(OrderedDict):
+    """least recently used service models.
+
+    pages sharing a model parse it once, while a build rendering every
+    commit page only holds a few parsed models at a time.
+    """
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def __getitem__(self, key):
+        self.move_to_end(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.size:
+            self.popitem(last=False)
+
+
 class TemplateAPI:
     # flyweight used per template render
-    def __init__(self, repo, build_time=None):
-        self.repo = pygit2.Repository(repo)
-        self.service_models = {}
+    def __init__(
+        self,
+        repo,
+        build_time=None,
+        service_models=None,
+        services=None,
+        model_history=None,
+        doc_engine="docutils",
+    ):
+        import pygit2
+
+        if not isinstance(repo, pygit2.Repository):
+            repo = pygit2.Repository(repo)
+        self.repo = repo
+        self.service_models = {} if service_models is None else service_models
+        # service name to ServiceMetadata
+        self.services = services or {}
         self.stats = Counter()
         self.build_time = build_time
+        self.model_history = model_history
+        # operation docs render with docutils, or opt in to the direct rst
+        # renderer, which falls back to docutils for markup it doesn't handle.
+        self.doc_engine = doc_engine
 
-    def get_service_title(self, service_name, commits):
+    def get_service(self, service_name):
+        return self.services.get(service_name)
+
+    def get_service_title(self, service_name, commits=()):
+        if service_name in self.services:
+            return self.services[service_name].title
         for c in commits:
             for s in c:
                 if s.name == service_name:
                     return s.title
         return service_name
 
+    def get_service_summary(self, service_name):
+        if service_name in self.services:
+            return self.services[service_name].summary
+        return ""
+
+    def get_models_at(self, service_name, tag):
+        """model path to blob id of a service's models as of a tag."""
+        if self.model_history is None or tag not in self.model_history.positions:
+            return {}
+        return self.model_history.models_at(service_name, tag)
+
     def get_service_doc(self, service_change):
-        return self._get_service_model(service_change).documentation
+        # documentation doesn't need a full service model
+        if service_change.model_file in self.service_models:
+            return self.service_models[service_change.model_file].documentation
+        if service_change.model_file == GIT_EMPTY_FILE:
+            return
+        data = json.loads(
+            self.repo[service_change.model_file].read_raw().decode("utf8")
+        )
+        return data.get("documentation", "")
 
     def get_human_age(self, rdate):
+        import arrow
+
         return arrow.get(rdate).humanize()
 
     def render_operation(self, service_change, op_name):
         # try and reuse botocore's sphinx doc infrastructure.
+        from botocore import hooks, xform_name
+        from botocore.docs.docstring import ClientMethodDocstring
+
         m = self._get_service_model(service_change)
         if m is None:
             log.error("couldnt find model %s", service_change)
@@ -146,9 +301,11 @@ class TemplateAPI:
             example_prefix="client.%s" % xform_name(opm.name),
             include_signature=False,
         )
-        return self._render_docutils(method_doc)
+        return self._render_doc(method_doc)
 
     def _get_service_model(self, service_change):
+        from .model import ServiceModel
+
         if service_change.model_file in self.service_models:
             return self.service_models[service_change.model_file]
         self.stats["model_load"] += 1
@@ -163,18 +320,22 @@ class TemplateAPI:
         self.service_models[service_change.model_file] = m
         return m
 
-    def _render_docutils(self, method_doc):
-        method_writer = Writer()
-        method_writer.translator_class = HTMLTranslator
+    def _render_doc(self, method_doc):
+        from .rst import UnsupportedMarkup, render, render_docutils
+
         self.stats["op_render"] += 1
         t = time.time()
-        parts = publish_parts(
-            str(method_doc),
-            settings_overrides={"report_level": 4},
-            writer=method_writer,
-        )
+        source = str(method_doc)
+        html = None
+        if self.doc_engine == "direct":
+            try:
+                html = render(source)
+            except UnsupportedMarkup:
+                self.stats["op_render_fallback"] += 1
+        if html is None:
+            html = render_docutils(source)
         self.stats["op_render_time"] += time.time() - t
-        return parts["fragment"]
+        return html
 
 
 class Site:
@@ -182,58 +343,207 @@ class Site:
     site_prefix = ""
     site_url = ""
     default_commit_days = 14
-
-    def __init__(self, repo_path, cache_path, template_dir, assets_dir):
+    service_feed_size = 20
+    write_buffer_size = 2**16
+    # read all release change logs from the walk's end tag up front, None
+    # preloads for full walks and backfill shards only, incremental walks
+    # read the change logs of the few releases they cover.
+    preload_change_logs = None
+    change_log_workers = 0
+    # operation doc renderer, docutils or direct (opt in)
+    doc_engine = "docutils"
+    # copy static assets under content hashed names
+    fingerprint_assets = True
+    # parsed service models kept between page renders
+    model_cache_size = 8
+
+    def __init__(
+        self,
+        repo_path,
+        cache_path,
+        template_dir,
+        assets_dir,
+        diff_cache_path=None,
+        store_path=None,
+        index_path=None,
+        template_cache_dir=None,
+        model_path="apis/",
+        model_suffix="normal.json",
+        change_dir=".changes",
+        canonical_diffs=False,
+        history_path=None,
+    ):
         self.repo_path = repo_path
         self.cache_path = Path(cache_path)
+        self.diff_cache_path = Path(
+            diff_cache_path or self.cache_path.with_name("diffs.db")
+        )
+        self.index_path = Path(index_path or self.cache_path.with_name("services.json"))
+        self.model_path = model_path
+        self.model_suffix = model_suffix
+        self.change_dir = change_dir
+        # sites for several sdks can share a diff cache keyed on model
+        # content, so each distinct model change is only diffed once.
+        self.canonical_diffs = canonical_diffs
+        # optional indexed change store, kept in sync with the commit cache
+        self.store_path = store_path and Path(store_path) or None
+        # optional model file history index, for model lookups by tag
+        self.history_path = history_path and Path(history_path) or None
+        self.model_history = None
         self.template_dir = Path(template_dir).resolve()
         self.assets_dir = assets_dir
-
-        self.commits = []
+        # asset path to fingerprinted path, filled by copy_assets
+        self.assets = {}
+
+        import jinja2
+
+        self.timeline = Timeline()
+        self.service_index = None
+        self.walkers = {}
+        self.service_models = ModelCache(self.model_cache_size)
+        # compiled templates persist across processes, jinja checks each
+        # cached entry against its template source checksum.
+        self.template_cache_dir = Path(
+            template_cache_dir or self.cache_path.with_name("template-cache")
+        )
+        self.template_cache_dir.mkdir(parents=True, exist_ok=True)
         self.env = jinja2.Environment(
             lstrip_blocks=True,
             trim_blocks=True,
             loader=jinja2.FileSystemLoader(str(template_dir)),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(str(self.template_cache_dir)),
         )
         self.pages = []
+        # loaded commits whose pages aren't built yet, a failed watch
+        # cycle leaves them here for the next build.
+        self.pending = []
         self.output = None
         self.build_time = datetime.utcnow()
 
+    @property
+    def commits(self) -> List[Commit]:
+        return self.timeline.commits
+
     def upload(self, output: Path, destination: str):
         pass
 
+    def get_walker(self, repo_path):
+        import pygit2
+
+        from .repo import TagWalker
+
+        repo_path = str(Path(repo_path).expanduser().resolve())
+        if repo_path not in self.walkers:
+            self.walkers[repo_path] = TagWalker(pygit2.Repository(repo_path))
+        return self.walkers[repo_path]
+
+    def fetch(self, remote="origin"):
+        try:
+            subprocess.run(
+                ["git", "-C", str(self.repo_path), "fetch", "-q", "--tags", remote],
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            log.warning("fetch from %s failed %s", remote, e)
+
+    def watch(
+        self,
+        output: Path,
+        interval: int = 300,
+        publisher=None,
+        fetch: bool = False,
+        persist_cmd=None,
+    ):
+        """Build (and publish) incrementally as new release tags appear.
+
+        Repository handles, the tag index and the commit history are
+        kept in memory between releases. Commits and pages of a failed
+        cycle are built and published again on the next poll, and
+        persist_cmd (e.g. just cache-upload) runs after each published
+        cycle so scheduled builds start from a current cache.
+        """
+        walker = self.get_walker(self.repo_path)
+        tags = None
+        unpublished = []
+        while True:
+            if fetch:
+                self.fetch()
+            current = walker.get_tag_refs()
+            if current != tags:
+                log.info(
+                    "watch building for %d new tags",
+                    len(current.difference(tags or ())),
+                )
+                walker.refresh()
+                try:
+                    unpublished.extend(self.build(output))
+                    if publisher:
+                        # first pass publishes the whole site.
+                        publisher.publish(
+                            list(dict.fromkeys(unpublished))
+                            if tags is not None
+                            else None
+                        )
+                    if persist_cmd:
+                        subprocess.run(persist_cmd, check=True)
+                except Exception:
+                    log.exception("watch build failed, retrying next poll")
+                else:
+                    tags = current
+                    unpublished = []
+            time.sleep(interval)
+
     def build(self, output: Path, destination: Optional[str] = None):
         log.info("build site")
+        t = time.time()
         self.output = output
-        new_commits = self.load(self.repo_path, self.cache_path)
-        self.build_index_pages(self.commits[: bisect_create_age(self.commits, 60)])
-        self.build_feed(self.commits[: bisect_create_age(self.commits, days=60)])
+        self.build_time = datetime.utcnow()
+        # a failed watch cycle may have left models behind
+        self.service_models.clear()
+        self.load(self.repo_path, self.cache_path)
+        new_commits = self.pending
+        # pages link to fingerprinted assets, so copy them first
+        self.copy_assets(output)
+        recent = self.timeline.age(60)
+        self.build_index_pages(recent)
+        self.build_feed(recent, set(group_by_service(new_commits)))
         if not new_commits:
             log.info("no changes")
         #            self.build_service_pages(self.commits)
-        #            self.build_commit_pages(self.commits[
-        #                :bisect_create_age(self.commits, self.default_commit_days)])
+        #            self.build_commit_pages(
+        #                self.timeline.age(self.default_commit_days))
         else:
             log.info("incremental build %d commits", len(new_commits))
             self.build_commit_pages(new_commits)
-            self.build_service_pages(self.commits, set(group_by_service(new_commits)))
-            self.build_search_index(
-                self.commits[: bisect_create_age(self.commits, days=365 + 60)]
-            )
-        self.copy_assets(output)
-        pages = list(self.pages)
+            self.build_service_pages(set(group_by_service(new_commits)))
+            self.build_search_index(self.timeline.age(365 + 60))
+        # pages of a failed build are rendered again, list each once
+        pages = list(dict.fromkeys(self.pages))
         self.pages = []
+        self.pending = []
+        self.service_models.clear()
+        log.info(
+            "build done pages:%d time:%0.2f peak rss:%s",
+            len(pages),
+            time.time() - t,
+            sizeof_fmt(peak_rss()),
+        )
         return pages
 
     def copy_assets(self, output, incremental=True):
         if not self.assets_dir:
             return
-        for atype in ("css", "js", "sprite", "icons"):
-            if incremental and atype == "icons":
-                continue
-            shutil.copytree(
-                self.assets_dir / atype, self.output / atype, dirs_exist_ok=True
-            )
+        atypes = ["css", "js", "sprite"]
+        if not incremental:
+            atypes.append("icons")
+        self.assets, written = copy_assets(
+            Path(self.assets_dir), Path(output), atypes, self.fingerprint_assets
+        )
+        # changed assets publish along with the pages
+        self.pages.extend(written)
+
+    def asset_url(self, path):
+        return "/%s" % self.assets.get(path, path)
 
     @classmethod
     def link(self, relative_path):
@@ -253,73 +563,119 @@ class Site:
         if p.exists() and not force:
             return
         t = time.time()
-        with p.open("w") as fh:
-            tapi = TemplateAPI(str(self.repo_path), self.build_time)
+        with p.open("w", buffering=self.write_buffer_size) as fh:
+            tapi = TemplateAPI(
+                self.get_walker(self.repo_path).repo,
+                self.build_time,
+                self.service_models,
+                self.service_index and self.service_index.metadata,
+                self.model_history,
+                self.doc_engine,
+            )
             kw["icon_style"] = get_icon_style
             kw["icon"] = get_icon
+            kw["asset"] = self.asset_url
             kw["api"] = tapi
             kw["build_time"] = self.build_time
             if template:
                 t = time.time()
-                fh.write(tpl.render(**kw))
+                # stream chunks rather than materializing the whole page
+                for chunk in tpl.generate(**kw):
+                    fh.write(chunk)
             else:
                 fh.write(kw["content"])
             self.pages.append(path)
 
         log.debug(
-            "page:%s size:%s time:%0.2f mtime:%0.2f models:%d op-time:%0.2f",
+            "page:%s size:%s time:%0.2f mtime:%0.2f models:%d op-time:%0.2f "
+            "ops:%d fallback:%d",
             path,
             sizeof_fmt(p.stat().st_size),
             time.time() - t,
             tapi.stats["model_load_time"],
             tapi.stats["model_load"],
             tapi.stats["op_render_time"],
+            tapi.stats["op_render"],
+            tapi.stats["op_render_fallback"],
         )
 
-    def build_feed(self, commits: List[Commit]):
-        log.info("build feed page %d" % len(commits))
-        feed = FeedGenerator()
-        feed.id("")
-        feed.title("AWS API Changes")
-        feed.author(
-            {
-                "name": "AWSPIChanges",
-                "email": "https://github.com/awslabs/aws-sdk-api-changes",
-            }
+    @contextmanager
+    def open_page(self, path):
+        """stream a page's content straight to its output file."""
+        p = self.output / path
+        p.parent.mkdir(parents=True, exist_ok=True)
+        t = time.time()
+        with p.open("w", buffering=self.write_buffer_size) as fh:
+            yield fh
+        self.pages.append(path)
+        log.debug(
+            "page:%s size:%s time:%0.2f",
+            path,
+            sizeof_fmt(p.stat().st_size),
+            time.time() - t,
         )
-        feed.link(href=self.site_url, rel="alternate")
-        feed.link(href="%s/feed/" % self.site_url, rel="self")
-        feed.description("AWS API ChangeLog")
-        feed.language("en-US")
-        feed.generator("artisan-sdk-gitops")
-        feed.image(
-            url="https://a0.awsstatic.com/main/images/logos/aws_logo_smile_179x109.png"
-        )  # noqa
-        for c in commits:
-            for s in c.service_changes:
-                fe = feed.add_entry(order="append")
-                fe.title(
-                    "{} - {}{}methods".format(
-                        s.title,
-                        s.count_new and "%d new " % s.count_new or "",
-                        s.count_updated and "%d updated " % s.count_updated or "",
-                    )
-                )
-                fe.id("{}-{}".format(c.id, s.name))
-                fe.description(s.change_log)
-                fe.link(
-                    {
-                        "href": self.link(
+
+    def write_feed(self, path, title, commits, service=None):
+        from .feed import FeedWriter
+
+        feed_url = "%s/feed/" % self.site_url
+        with self.open_page(path) as fh, FeedWriter(
+            fh,
+            title=title,
+            link=self.site_url or feed_url,
+            # each service feed is its own document
+            self_link=self.link(path),
+            description="AWS API ChangeLog",
+            generator="artisan-sdk-gitops",
+            image="https://a0.awsstatic.com/main/images/logos/aws_logo_smile_179x109.png",  # noqa
+            language="en-US",
+            build_date=datetime.now(tzutc()),
+        ) as feed:
+            for c in commits:
+                for s in c.service_changes:
+                    if service and s.name != service:
+                        continue
+                    feed.add_entry(
+                        title="{} - {}{}methods".format(
+                            s.title,
+                            s.count_new and "%d new " % s.count_new or "",
+                            s.count_updated and "%d updated " % s.count_updated or "",
+                        ),
+                        link=self.link(
                             "archive/changes/%s-%s.html" % (c.id[:6], s.name)
-                        )
-                    }
-                )
-                fe.published(c.created)
-        self.render_page(
-            "feed/feed.rss",
-            force=True,
-            content=feed.rss_str(pretty=True).decode("utf8"),
-        )
+                        ),
+                        guid="{}-{}".format(c.id, s.name),
+                        published=c.created,
+                        description=s.change_log,
+                    )
+        return feed.count
+
+    def build_feed(self, commits: List[Commit], services=None):
+        """write the site feed and per service feeds.
+
+        Service feeds are only rewritten for the given services, or
+        where missing from the output.
+        """
+        log.info("build feed page %d" % len(commits))
+        self.write_feed("feed/feed.rss", "AWS API Changes", commits)
+
+        count = 0
+        for history in self.service_index:
+            path = "feed/%s.rss" % history.name
+            if services is not None and history.name not in services:
+                if (self.output / path).exists():
+                    continue
+            self.write_feed(
+                path,
+                "AWS API Changes - %s" % history.title,
+                [
+                    self.timeline.get(cid)
+                    for cid in history.commits[: self.service_feed_size]
+                ],
+                history.name,
+            )
+            count += 1
+        log.info("build service feeds %d", count)
 
     def build_search_index(self, commits: List[Commit]):
         log.info("build search index %d" % len(commits))
@@ -353,31 +709,27 @@ class Site:
                     force=True,
                 )
 
-    def build_service_pages(self, commits: List[Commit], services=None):
-        groups = group_by_service(commits)
-        for svc_name in sorted(groups):
-            if services and svc_name not in services:
+    def build_service_pages(self, services=None):
+        for history in sorted(self.service_index, key=operator.attrgetter("name")):
+            if services and history.name not in services:
                 continue
-            svc_title = list(groups[svc_name][0].select(svc_name))[0].title
             self.render_page(
-                "archive/service/{}/index.html".format(svc_name),
+                "archive/service/{}/index.html".format(history.name),
                 "service.j2",
-                service=svc_name,
-                service_title=svc_title,
-                releases=groups[svc_name],
+                service=history.name,
+                service_title=history.title,
+                releases=[self.timeline.get(cid) for cid in history.commits],
                 force=True,
             )
         self.render_page(
             "archive/service/index.html",
             "service-map.j2",
-            services=sorted(groups, key=lambda s: groups[s][0].created, reverse=True),
-            changes=groups,
+            services=self.service_index.ordered(),
             force=True,
         )
 
-    #    def build_month_archive(self, commits):
-    #        for (year, month), mcommits in group_by_date(
-    #                commits, month=True).items():
+    #    def build_month_archive(self):
+    #        for (year, month), mcommits in self.timeline.months().items():
     #            dt = datetime(year=year, month=month, day=1)
     #            self.render_page(
     #                'archive/index/{}/{}/index.html'.format(year, month),
@@ -407,38 +759,147 @@ class Site:
 
     def load(self, repo_path: str, cache_path: str, since: Optional[str] = None):
         log.info("git walking repository")
-        commits = []
-        if os.path.exists(cache_path):
-            with open(cache_path) as fh:
-                commits = Commit.schema().loads(fh.read(), many=True)
-        commits.sort(key=operator.attrgetter("created"), reverse=True)
-        self.commits = commits
-        if not commits:
+        if not self.timeline and os.path.exists(cache_path):
+            with open(cache_path, "rb") as fh:
+                self.timeline = Timeline(record.loads(fh.read()))
+        if not self.timeline:
             new_commits = self._load(repo_path, since=since)
             if since is None:  # last commit is typically an import
                 new_commits.pop(-1)
         else:
-            new_commits = self._load(repo_path, since=commits[0].tag)
-        self.commits.extend(new_commits)
-        self.commits.sort(key=operator.attrgetter("created"), reverse=True)
-        with open(cache_path, "w") as fh:
-            fh.write(Commit.schema().dumps(self.commits, many=True))
+            new_commits = self._load(repo_path, since=self.commits[0].tag)
+        self.pending.extend(new_commits)
+        self.timeline.insert(new_commits)
+        self.load_service_index(new_commits)
+        self.save_commits(cache_path)
+        if self.history_path:
+            self.update_model_history()
         return new_commits
 
+    def save_commits(self, cache_path):
+        # json caches stay json, any other suffix uses the compact codec.
+        with open(cache_path, "wb") as fh:
+            fh.write(
+                record.dumps(self.commits, compact=Path(cache_path).suffix != ".json")
+            )
+        if self.store_path:
+            from .store import ChangeStore
+
+            store = ChangeStore(self.store_path)
+            try:
+                store.sync(self.commits)
+            finally:
+                store.close()
+
+    def update_model_history(self):
+        from .history import ModelHistory
+
+        if self.model_history is None:
+            self.model_history = ModelHistory(
+                self.history_path, self.model_path, self.model_suffix
+            )
+        self.model_history.update(self.get_walker(self.repo_path))
+
+    def load_service_index(self, new_commits: List[Commit]):
+        index = self.service_index
+        if index is None and self.index_path.exists():
+            index = ServiceIndex.loads(self.index_path.read_bytes())
+        if index is not None and index.count + len(new_commits) == len(self.timeline):
+            index.update(new_commits)
+        else:
+            log.info("rebuilding service index")
+            metadata = index is not None and index.metadata or {}
+            index = ServiceIndex.from_commits(self.timeline.commits)
+            # entries are checked against their model blob below
+            index.metadata = metadata
+        self.update_service_metadata(index)
+        self.service_index = index
+        self.index_path.write_bytes(index.dumps())
+
+    def update_service_metadata(self, index: ServiceIndex):
+        repo = self.get_walker(self.repo_path).repo
+        stale = index.stale_metadata()
+        for history in stale:
+            data = {}
+            if history.model_file != GIT_EMPTY_FILE and history.model_file in repo:
+                data = json.loads(repo[history.model_file].read_raw().decode("utf8"))
+            icon = get_icon_style(
+                history.name in ICON_SERVICE_MAP and history.name or "aws"
+            )
+            index.metadata[history.name] = ServiceMetadata.from_model(
+                history, data, icon
+            )
+        if stale:
+            log.info("updated service metadata %d", len(stale))
+
+    def load_shard(
+        self, since: Optional[str], until: str, logs_until: Optional[str] = None
+    ) -> List[Commit]:
+        """diff one tag range of a sharded backfill.
+
+        logs_until is the end of the whole backfill, so change logs are
+        read from the same tree a single walk would read them from.
+        """
+        return self._load(self.repo_path, since, until, logs_until)
+
+    def merge_shards(self, shards: List[List[Commit]]) -> List[Commit]:
+        """write the commit cache and service index from shard results.
+
+        shards are given in range order, commits on the same date then
+        keep the order a single walk produces.
+        """
+        seen = set()
+        commits = []
+        for shard in shards:
+            for c in shard:
+                if c.id not in seen:
+                    seen.add(c.id)
+                    commits.append(c)
+        self.timeline = Timeline(commits)
+        self.service_index = None
+        self.load_service_index(self.commits)
+        self.save_commits(self.cache_path)
+        log.info("merged %d shards %d commits", len(shards), len(commits))
+        return self.commits
+
     def _load(
-        self, repo_path: str, since: Optional[str] = None, until: Optional[str] = None
+        self,
+        repo_path: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        logs_until: Optional[str] = None,
     ) -> List[Commit]:
-        repo = pygit2.Repository(str(Path(repo_path).expanduser().resolve()))
-        walker = TagWalker(repo)
+        from .cache import DiffCache
+        from .model import ReleaseDelta
+        from .repo import CommitProcessor
+
+        walker = self.get_walker(repo_path)
+        diff_cache = DiffCache(self.diff_cache_path)
         delta = CommitProcessor(
-            repo,
-            change_dir=".changes",
-            model_prefix="apis/",
-            model_suffix="normal.json",
+            walker.repo,
+            change_dir=self.change_dir,
+            model_prefix=self.model_path,
+            model_suffix=self.model_suffix,
+            diff_cache=diff_cache,
+            canonical=self.canonical_diffs,
         )
-        releases = []
-        for _, _, commit_info, change_diff in walker.walk(since, until):
-            svc_changes = delta.process(commit_info, change_diff)
-            if svc_changes:
-                releases.append(ReleaseDelta(commit_info, svc_changes))
-        return list(Commit.from_commits(releases))
+        preload = self.preload_change_logs
+        if preload is None:
+            preload = since is None or logs_until is not None
+        if preload and self.change_dir:
+            delta.preload_change_logs(
+                walker.get_end_tree(logs_until or until), self.change_log_workers
+            )
+        commits = []
+        try:
+            for _, _, commit_info, change_diff in walker.walk(since, until):
+                svc_changes = delta.process(commit_info, change_diff)
+                if svc_changes:
+                    # keep only the flattened record of each release
+                    commits.extend(
+                        Commit.from_commits([ReleaseDelta(commit_info, svc_changes)])
+                    )
+        finally:
+            diff_cache.close()
+            delta.aliases.report()
+        return commits
@@ -0,0 +1,270 @@
+import json
+import logging
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from .record import Commit, ServiceChange, encode_value
+
+log = logging.getLogger("apichanges.store")
+
+SCHEMA = (
+    "create table if not exists commits ("
+    "id text primary key, tag text, created real, utcoffset integer)",
+    "create table if not exists service_changes ("
+    "commit_id text, service text, title text, change_log text, "
+    "new integer, model_file text, created real)",
+    "create table if not exists operation_changes ("
+    "commit_id text, service text, operation text, type text, "
+    "delta text, created real)",
+    "create index if not exists commits_created on commits (created)",
+    "create index if not exists service_changes_service "
+    "on service_changes (service, created)",
+    "create index if not exists service_changes_commit "
+    "on service_changes (commit_id)",
+    "create index if not exists operation_changes_operation "
+    "on operation_changes (operation, created)",
+    "create index if not exists operation_changes_commit "
+    "on operation_changes (commit_id, service)",
+)
+
+
+def to_timestamp(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return value.timestamp()
+
+
+def where_sql(clauses):
+    return clauses and " where %s" % " and ".join(clauses) or ""
+
+
+class ChangeStore(object):
+    """Indexed store of the commit history.
+
+    Commits, service changes and operation changes are stored in their
+    own tables with the commit date denormalized onto each row, so
+    lookups by service, operation and date range only touch the
+    matching rows instead of scanning the whole history.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.execute("create temp table matched (id text)")
+        self.timezones = {}
+
+    def commit_ids(self):
+        return {r[0] for r in self.conn.execute("select id from commits")}
+
+    def sync(self, commits: Iterable[Commit]) -> int:
+        """add any commits not yet in the store, returns the count added."""
+        known = self.commit_ids()
+        added = [c for c in commits if c.id not in known]
+        self.add(added)
+        if added:
+            log.info("change store added %d commits", len(added))
+        return len(added)
+
+    def add(self, commits: Iterable[Commit]):
+        for c in commits:
+            created = c.created.timestamp()
+            offset = c.created.utcoffset()
+            self.remove(c.id)
+            self.conn.execute(
+                "insert into commits values (?, ?, ?, ?)",
+                (c.id, c.tag, created, offset and int(offset.total_seconds()) or 0),
+            )
+            for s in c.service_changes:
+                self.conn.execute(
+                    "insert into service_changes values (?, ?, ?, ?, ?, ?, ?)",
+                    (c.id, s.name, s.title, s.change_log, s.new, s.model_file, created),
+                )
+                self.conn.executemany(
+                    "insert into operation_changes values (?, ?, ?, ?, ?, ?)",
+                    [(c.id, s.name, op, "new", None, created) for op in s.ops_added]
+                    + [
+                        (
+                            c.id,
+                            s.name,
+                            op,
+                            "updated",
+                            json.dumps(s.ops_changes.get(op), default=encode_value),
+                            created,
+                        )
+                        for op in s.ops_updated
+                    ],
+                )
+
+    def remove(self, commit_id):
+        for table, column in (
+            ("commits", "id"),
+            ("service_changes", "commit_id"),
+            ("operation_changes", "commit_id"),
+        ):
+            self.conn.execute(
+                "delete from %s where %s = ?" % (table, column), (commit_id,)
+            )
+
+    def services(self):
+        """map of service name to its most recent title."""
+        # sqlite takes bare columns from the max() row
+        return {
+            service: title
+            for service, title, _ in self.conn.execute(
+                "select service, title, max(created) from service_changes "
+                "group by service"
+            )
+        }
+
+    def commits(
+        self,
+        service: Optional[str] = None,
+        operation: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> List[Commit]:
+        """commits newest first, with service changes filtered to matches.
+
+        since and until are inclusive bounds on the commit date.
+        """
+        # operation lookups are driven from the operation index
+        if operation:
+            table = "operation_changes"
+            matched, id_params = self.operation_filter(
+                "m", service, operation, since, until
+            )
+        else:
+            table = "service_changes"
+            matched, id_params = self.service_filter("m", service, None, since, until)
+        commit_ids = "select distinct m.commit_id from %s m%s" % (
+            table,
+            where_sql(matched),
+        )
+        commit_ids += " order by m.created desc%s" % (
+            limit and " limit %d" % limit or ""
+        )
+        # matched ids are staged in a temp table for the record lookups
+        self.conn.execute("delete from matched")
+        self.conn.execute("insert into matched (id) %s" % commit_ids, id_params)
+
+        clauses, params = self.service_filter("s", service, operation, since, until)
+        services = {}
+        for cid, name, title, change_log, new, model_file in self.conn.execute(
+            "select s.commit_id, s.service, s.title, s.change_log, s.new, "
+            "s.model_file from service_changes s "
+            "where s.commit_id in (select id from matched)%s"
+            % "".join(" and %s" % c for c in clauses),
+            params,
+        ):
+            services.setdefault(cid, {})[name] = ServiceChange(
+                name=name,
+                title=title,
+                change_log=change_log,
+                new=bool(new),
+                ops_added=[],
+                ops_updated=[],
+                ops_changes={},
+                model_file=model_file,
+            )
+        if not services:
+            return []
+
+        for cid, name, op, otype, delta in self.conn.execute(
+            "select commit_id, service, operation, type, delta "
+            "from operation_changes where commit_id in (select id from matched) "
+            "order by rowid"
+        ):
+            s = services[cid].get(name)
+            if s is None:
+                continue
+            if otype == "new":
+                s.ops_added.append(op)
+            else:
+                s.ops_updated.append(op)
+                s.ops_changes[op] = json.loads(delta)
+
+        commits = [
+            Commit(
+                id=cid,
+                tag=tag,
+                created=datetime.fromtimestamp(created, self.get_timezone(offset)),
+                service_changes=list(services[cid].values()),
+            )
+            for cid, tag, created, offset in self.conn.execute(
+                "select c.id, c.tag, c.created, c.utcoffset from matched m "
+                "join commits c on c.id = m.id order by m.rowid"
+            )
+        ]
+        return commits
+
+    def service_filter(self, alias, service, operation, since, until):
+        clauses, params = [], []
+        if service:
+            clauses.append("%s.service = ?" % alias)
+            params.append(service)
+        if operation:
+            clauses.append(
+                "exists (select 1 from operation_changes o "
+                "where o.commit_id = {a}.commit_id and o.service = {a}.service "
+                "and o.operation = ?)".format(a=alias)
+            )
+            params.append(operation)
+        if since:
+            clauses.append("%s.created >= ?" % alias)
+            params.append(to_timestamp(since))
+        if until:
+            clauses.append("%s.created <= ?" % alias)
+            params.append(to_timestamp(until))
+        return clauses, params
+
+    def operation_filter(self, alias, service, operation, since, until):
+        clauses, params = [], []
+        for column, op, value in (
+            ("service", "=", service),
+            ("operation", "=", operation),
+            ("created", ">=", to_timestamp(since)),
+            ("created", "<=", to_timestamp(until)),
+        ):
+            if value is not None:
+                clauses.append("%s.%s %s ?" % (alias, column, op))
+                params.append(value)
+        return clauses, params
+
+    def operations(
+        self,
+        service: Optional[str] = None,
+        operation: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        """operation changes newest first, as (date, tag, service, operation, type)."""
+        clauses, params = self.operation_filter("o", service, operation, since, until)
+        for created, offset, tag, svc, op, otype in self.conn.execute(
+            "select o.created, c.utcoffset, c.tag, o.service, o.operation, o.type "
+            "from operation_changes o join commits c on c.id = o.commit_id "
+            "%s order by o.created desc, o.rowid" % where_sql(clauses),
+            params,
+        ):
+            yield (
+                datetime.fromtimestamp(created, self.get_timezone(offset)),
+                tag,
+                svc,
+                op,
+                otype,
+            )
+
+    def get_timezone(self, offset):
+        if offset not in self.timezones:
+            self.timezones[offset] = timezone(timedelta(seconds=offset))
+        return self.timezones[offset]
+
+    def flush(self):
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -33,7 +33,7 @@ setup(
         "python-dateutil==2.8.0",
         "six==1.13.0",
         "lxml==4.9.1",
-        "feedgen>=0.9.0",
+        "msgpack>=1.0.0",
         "urllib3==1.26.18"
     ],
 )
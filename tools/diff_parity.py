@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# verify the raw json diff engine against the visitor based engine
+# over a tag range of an sdk repo, reporting any delta mismatches
+# and the time spent in each engine.
+
+import json
+import time
+
+import click
+import pygit2
+
+from apichanges.model import diff_model, diff_raw_model
+from apichanges.repo import TagWalker
+
+
+def summarize(svc_change):
+    if svc_change is None:
+        return None
+    return (
+        svc_change.new,
+        sorted(c.op for c in svc_change if c.type == "new"),
+        {c.op: c.delta for c in svc_change if c.type == "updated"},
+    )
+
+
+@click.command()
+@click.option('--path', required=True, help="Path to AWS SDK git clone")
+@click.option('--since', required=True, help="Start Date or Tag")
+@click.option('--until', help="End Date or Tag")
+@click.option('--model-path', required=True, help="model directory prefix")
+@click.option('--model-suffix', required=True, help="suffix for model files")
+def main(path, since, until, model_path, model_suffix):
+    repo = pygit2.Repository(path)
+    timings = {'visitor': 0, 'raw': 0}
+    count = mismatches = 0
+
+    for _, _, info, change_diff in TagWalker(repo).walk(since, until):
+        for d in change_diff.deltas:
+            dpath = d.new_file.path
+            if not (dpath.startswith(model_path) and dpath.endswith(model_suffix)):
+                continue
+            if d.status_char() not in ('A', 'M'):
+                continue
+            new = json.loads(repo[d.new_file.id].read_raw().decode('utf8'))
+            old = None
+            if d.status_char() == 'M':
+                old = json.loads(repo[d.old_file.id].read_raw().decode('utf8'))
+
+            results = {}
+            for engine, differ in (('visitor', diff_model), ('raw', diff_raw_model)):
+                t = time.time()
+                results[engine] = summarize(differ(new, old))
+                timings[engine] += time.time() - t
+            count += 1
+            if results['visitor'] != results['raw']:
+                mismatches += 1
+                print('mismatch tag:%s file:%s' % (info['tag'], dpath))
+
+    print('compared %d model diffs, %d mismatches' % (count, mismatches))
+    print('visitor: %0.2fs raw: %0.2fs speedup: %0.1fx' % (
+        timings['visitor'], timings['raw'],
+        timings['visitor'] / (timings['raw'] or 1)))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
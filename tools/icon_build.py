@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 
-# note we'll use glue to assemble a css sprite
-# for now we use this to pickup the images we want, convert
-# from svg to png in our preferred size
-
-import click
-import cairosvg
+# pick up the aws architecture icons we use, convert them from svg to
+# png in our preferred size and assemble the css sprite sheet.
+#
+# rasterization runs in a process pool, and targets whose svg source
+# and size are unchanged since the last run are skipped, so adding an
+# icon only renders that icon.
+
+import hashlib
+import json
+import math
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+
+import click
 from jinja2 import Template
 
 from apichanges.icons import ICON_SERVICE_MAP
@@ -18,55 +25,125 @@ CSS_BUILD = """
 {% endfor %}
 """
 
+# glue compatible class names and layout, see apichanges.icons.get_icon_style
+SPRITE_CSS_BUILD = """
+{{ classes|join(',') }}{background-image:url({{ image }});background-repeat:no-repeat}
+{% for cls, x, y in positions %}
+{{ cls }}{background-position:{{ x }} {{ y }};width:{{ size }}px;height:{{ size }}px;}
+{% endfor %}
+"""
+
+STATE_FILE = '.icon-build.json'
+
+
+def rasterize(origin, target, size):
+    import cairosvg
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    cairosvg.svg2png(
+        url=str(origin),
+        write_to=str(target),
+        output_width=size,
+        output_height=size)
+    return target
+
+
+def source_hash(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def css_offset(px):
+    return px and '-%dpx' % px or '0'
+
+
+def build_sprite(images, sprite_dir, size, name='images'):
+    from PIL import Image
+
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    sheet = Image.new('RGBA', (columns * size, rows * size))
+    positions = []
+    for idx, path in enumerate(images):
+        x, y = (idx % columns) * size, (idx // columns) * size
+        with Image.open(path) as img:
+            img = img.convert('RGBA')
+            if img.size != (size, size):
+                img = img.resize((size, size))
+            sheet.paste(img, (x, y))
+        positions.append((
+            '.sprite-%s-%s' % (name, path.stem), css_offset(x), css_offset(y)))
+
+    sprite_dir.mkdir(parents=True, exist_ok=True)
+    sheet.save(str(sprite_dir / ('%s.png' % name)), optimize=True)
+    with (sprite_dir / ('%s.css' % name)).open('w') as fh:
+        fh.write(Template(
+            SPRITE_CSS_BUILD, lstrip_blocks=True, trim_blocks=True).render(
+                classes=[p[0] for p in positions],
+                image='%s.png' % name,
+                positions=positions,
+                size=size).lstrip())
+
 
 @click.command()
 @click.option('-s', '--source', required=True, type=click.Path())
 @click.option('-d', '--destination', required=True, type=click.Path())
+@click.option('--sprite', type=click.Path(), help="sprite sheet directory")
 @click.option('--size', type=int, default=128)
-def main(source, destination, size):
+@click.option('--workers', type=int, help="rasterize processes, default per cpu")
+@click.option('--force', is_flag=True, help="rasterize unchanged icons")
+def main(source, destination, sprite, size, workers, force):
 
     source = Path(source).expanduser().resolve()
     destination = Path(destination).expanduser().resolve()
+    destination.mkdir(parents=True, exist_ok=True)
+
+    # rasterized icons by png name, and the icons the sprite was built from
+    state_path = destination / STATE_FILE
+    state = {'icons': {}, 'sprite': None}
+    if state_path.exists() and not force:
+        state.update(json.loads(state_path.read_text()))
 
-    count = 0
-    icons = {}
     used = set()
+    current = {}
+    pending = []
     icon_2_service = {
         v: k for k, v in ICON_SERVICE_MAP.items()}
 
     for dirpath, dirnames, filenames in os.walk(str(source)):
         dirpath = Path(dirpath)
-        for f in filenames:
+        for f in sorted(filenames):
             if not f.endswith('_dark-bg.svg'):
                 continue
-            origin = (dirpath / f)    
+            origin = (dirpath / f)
             n = origin.name
             name = n[:n.find('_dark')].replace('.', '_')
 
             service = icon_2_service.get(name)
             if service is None:
                 continue
-            if name in icons:
+            if name in used:
                 continue
             used.add(name)
 
             target = destination / ("%s.png" % name.lower())
-#            if target.exists():
-#                continue
-            count += 1          
-            target.parent.mkdir(parents=True, exist_ok=True)
-#            print('{} -> {}'.format(origin, target))
-
-            cairosvg.svg2png(
-                url=str(origin),
-                write_to=str(target),
-                output_width=size,
-                output_height=size)
+            current[target.name] = {'source': source_hash(origin), 'size': size}
+            unchanged = state['icons'].get(target.name) == current[target.name]
+            if target.exists() and unchanged:
+                continue
+            pending.append((origin, target, size))
+
+    if pending:
+        with ProcessPoolExecutor(workers) as executor:
+            list(executor.map(rasterize, *zip(*pending)))
 
     if set(icon_2_service).difference(used):
         print('missing service icons %s' % (', '.join(
             set(icon_2_service).difference(used))))
-    print('copied %d icons' % count)
+    print('rasterized %d icons, %d unchanged' % (
+        len(pending), len(current) - len(pending)))
+    state['icons'] = current
+    state_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+
     with (destination / 'icons.css').open('w') as fh:
         icons = {k: "icons/%s.png" % v.lower()
                  for k, v in ICON_SERVICE_MAP.items()}
@@ -74,7 +151,21 @@ def main(source, destination, size):
             CSS_BUILD, lstrip_blocks=True, trim_blocks=True).render(
                 icons=icons))
 
+    if not sprite:
+        return
+    sprite = Path(sprite).expanduser().resolve()
+    # the sheet holds exactly the current icons, keyed on their sources
+    # and size rather than whatever pngs sit in the destination.
+    outputs = (sprite / 'images.png', sprite / 'images.css')
+    if state['sprite'] == current and all(p.exists() for p in outputs):
+        print('sprite unchanged')
+        return
+    images = [destination / name for name in sorted(current)]
+    build_sprite(images, sprite, size)
+    state['sprite'] = current
+    state_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+    print('sprite %d icons -> %s' % (len(images), sprite))
+
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# measure cold import time of the apichanges modules, each in a fresh
+# interpreter via -X importtime, and optionally fail when the cli
+# entry point exceeds a startup budget.
+
+import subprocess
+import sys
+
+import click
+
+MODULES = (
+    'apichanges.cli',
+    'apichanges.model',
+    'apichanges.record',
+    'apichanges.repo',
+    'apichanges.sitebuild',
+)
+
+
+def import_time(module):
+    # -X importtime reports per module self and cumulative microseconds
+    # on stderr, the last line being the requested module.
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True)
+    line = result.stderr.strip().splitlines()[-1]
+    return int(line.split('|')[1]) / 1000.0
+
+
+@click.command()
+@click.option('-m', '--module', multiple=True, help="Module to measure")
+@click.option('-n', '--runs', default=5, help="Runs per module, best is kept")
+@click.option('--max-ms', type=float, help="Fail if apichanges.cli exceeds this")
+def main(module, runs, max_ms):
+    results = {}
+    for m in module or MODULES:
+        results[m] = min(import_time(m) for i in range(runs))
+        print('%-24s %8.1fms' % (m, results[m]))
+
+    cli_time = results.get('apichanges.cli') or import_time('apichanges.cli')
+    if max_ms and cli_time > max_ms:
+        print('apichanges.cli import %0.1fms exceeds budget %0.1fms' % (
+            cli_time, max_ms))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# compare the json and compact commit cache codecs on a synthetic
+# history, reporting encode/decode time, size and optionally the memory
+# retained by the loaded records (tracemalloc slows the load down a lot,
+# so timings come from a separate untraced load).
+
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import click
+
+from apichanges import record
+from apichanges.icons import ICON_SERVICE_MAP
+
+
+def synthetic_history(changes, per_commit=10, seed=42):
+    rng = random.Random(seed)
+    services = sorted(ICON_SERVICE_MAP)
+    ops = ['%s%s' % (verb, noun) for verb in (
+        'Create', 'Delete', 'Describe', 'List', 'Update', 'Get', 'Put')
+        for noun in ('Instance', 'Volume', 'Bucket', 'Policy', 'Stack',
+                     'Function', 'Table', 'Cluster', 'Job', 'Endpoint')]
+    created = datetime(2015, 1, 1, tzinfo=timezone(timedelta(hours=-8)))
+    commits = []
+    for i in range(0, changes, per_commit):
+        created += timedelta(hours=rng.randint(1, 30))
+        svc_changes = []
+        for svc in rng.sample(services, per_commit):
+            added = rng.sample(ops, rng.randint(0, 3))
+            updated = rng.sample(ops, rng.randint(0, 4))
+            svc_changes.append(record.ServiceChange(
+                name=svc,
+                title='Amazon %s' % svc.title(),
+                change_log='Updates the %s api with new features.' % svc,
+                new=False,
+                ops_added=added,
+                ops_updated=updated,
+                ops_changes={op: {'request': {'Filters': ['string']}}
+                             for op in updated},
+                model_file='%040x' % rng.getrandbits(160)))
+        commits.append(record.Commit(
+            id='%040x' % rng.getrandbits(160),
+            tag='v2.%d.0' % i,
+            created=created,
+            service_changes=svc_changes))
+    return commits
+
+
+def measure_load(data):
+    gc.collect()
+    t = time.time()
+    commits = record.loads(data)
+    return commits, time.time() - t
+
+
+def measure_memory(data):
+    gc.collect()
+    tracemalloc.start()
+    commits = record.loads(data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del commits
+    return retained, peak
+
+
+@click.command()
+@click.option('--changes', default=50000, help="Service changes in the history")
+@click.option('--memory/--no-memory', default=False,
+              help="Also trace memory retained by the loaded records")
+def main(changes, memory):
+    commits = synthetic_history(changes)
+    print('history: %d commits %d service changes' % (
+        len(commits), sum(len(c.service_changes) for c in commits)))
+    print('%-8s %10s %10s %10s %12s %12s' % (
+        'codec', 'size', 'dump', 'load', 'retained', 'peak'))
+    for codec, compact in (('json', False), ('compact', True)):
+        t = time.time()
+        data = record.dumps(commits, compact=compact)
+        dump_time = time.time() - t
+        loaded, load_time = measure_load(data)
+        assert len(loaded) == len(commits)
+        del loaded
+        retained = peak = 0
+        if memory:
+            retained, peak = measure_memory(data)
+        print('%-8s %9.1fM %9.2fs %9.2fs %11.1fM %11.1fM' % (
+            codec, len(data) / 2.0 ** 20, dump_time, load_time,
+            retained / 2.0 ** 20, peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# golden output corpus for the direct rst renderer. record samples
+# botocore operation docs covering each distinct set of rendered
+# elements and stores the html of the installed docutils release, which
+# should be the pinned one. check renders the corpus with the direct
+# renderer and fails on any difference, without needing docutils to
+# render anything.
+
+import difflib
+import gzip
+import json
+import re
+from pathlib import Path
+
+import click
+import docutils
+from botocore.session import get_session
+
+from apichanges.rst import UnsupportedMarkup, render, render_docutils
+
+from rst_parity import operation_docs
+
+CORPUS = Path(__file__).parent / 'rst_golden.json.gz'
+ELEMENT = re.compile(r'<(\w+)(?: class="([^"]*)")?')
+
+
+def signature(html, fallback):
+    return (fallback or '',) + tuple(sorted(set(ELEMENT.findall(html))))
+
+
+@click.group()
+def cli():
+    """golden corpus for the direct rst renderer"""
+
+
+@cli.command()
+@click.option('--corpus', type=click.Path(), default=str(CORPUS))
+@click.option('--per-signature', type=int, default=2,
+              help="Operations kept per distinct set of elements")
+def record(corpus, per_signature):
+    """render sampled operation docs with the installed docutils"""
+    session = get_session()
+    seen = {}
+    docs = []
+    for svc in session.get_available_services():
+        for op_name, source in operation_docs(session, svc):
+            html = render_docutils(source)
+            try:
+                render(source)
+                fallback = None
+            except UnsupportedMarkup as e:
+                fallback = str(e)
+            sig = signature(html, fallback)
+            if seen.get(sig, 0) >= per_signature:
+                continue
+            seen[sig] = seen.get(sig, 0) + 1
+            docs.append({'op': '%s.%s' % (svc, op_name), 'source': source,
+                         'html': html, 'fallback': fallback})
+    with gzip.open(corpus, 'wt') as fh:
+        json.dump({'docutils': docutils.__version__, 'docs': docs}, fh,
+                  indent=0, sort_keys=True)
+    print('recorded %d docs, %d signatures, docutils %s' % (
+        len(docs), len(seen), docutils.__version__))
+
+
+@cli.command()
+@click.option('--corpus', type=click.Path(exists=True), default=str(CORPUS))
+@click.option('--show', type=int, default=5, help="Mismatch diffs to print")
+def check(corpus, show):
+    """compare the direct renderer against the corpus"""
+    with gzip.open(corpus, 'rt') as fh:
+        data = json.load(fh)
+    if data['docutils'] != docutils.__version__:
+        raise click.ClickException(
+            'corpus rendered with docutils %s, installed %s' % (
+                data['docutils'], docutils.__version__))
+    mismatches = 0
+    for doc in data['docs']:
+        try:
+            html = render(doc['source'])
+        except UnsupportedMarkup as e:
+            # markup the direct renderer doesn't handle is fine, as long
+            # as it stays unhandled rather than rendered differently.
+            html = doc['fallback'] and doc['html'] or 'fallback %s' % e
+        if html == doc['html']:
+            continue
+        mismatches += 1
+        print('mismatch %s' % doc['op'])
+        if mismatches <= show:
+            print(''.join(list(difflib.unified_diff(
+                doc['html'].splitlines(True), html.splitlines(True),
+                'golden', 'direct', n=2))[:40]))
+    print('checked %d docs, %d mismatches, docutils %s' % (
+        len(data['docs']), mismatches, data['docutils']))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    cli()
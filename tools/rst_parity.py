@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# verify the direct rst renderer against docutils over the operation
+# docs of botocore's bundled service models, reporting any html
+# mismatches, how many docs fell back to docutils and the time spent
+# in each engine.
+
+import difflib
+import time
+from collections import Counter
+
+import click
+from botocore import hooks, xform_name
+from botocore.docs.docstring import ClientMethodDocstring
+from botocore.session import get_session
+
+from apichanges.rst import UnsupportedMarkup, render, render_docutils
+
+
+def operation_docs(session, service):
+    model = session.get_service_model(service)
+    for op_name in model.operation_names:
+        opm = model.operation_model(op_name)
+        yield op_name, str(ClientMethodDocstring(
+            operation_model=opm,
+            method_name=opm.name,
+            event_emitter=hooks.HierarchicalEmitter(),
+            method_description=opm.documentation,
+            example_prefix='client.%s' % xform_name(opm.name),
+            include_signature=False))
+
+
+@click.command()
+@click.option('--service', multiple=True, help="Service to check, default all")
+@click.option('--limit', type=int, help="Max operations per service")
+@click.option('--show', type=int, default=5, help="Mismatch diffs to print")
+def main(service, limit, show):
+    session = get_session()
+    services = service or session.get_available_services()
+    timings = {'docutils': 0, 'direct': 0}
+    fallbacks = Counter()
+    count = mismatches = 0
+
+    for svc in services:
+        for idx, (op_name, source) in enumerate(operation_docs(session, svc)):
+            if limit and idx >= limit:
+                break
+            count += 1
+            t = time.time()
+            expected = render_docutils(source)
+            timings['docutils'] += time.time() - t
+            t = time.time()
+            try:
+                html = render(source)
+            except UnsupportedMarkup as e:
+                fallbacks[str(e)] += 1
+                continue
+            finally:
+                timings['direct'] += time.time() - t
+            if html == expected:
+                continue
+            mismatches += 1
+            print('mismatch %s.%s' % (svc, op_name))
+            if mismatches <= show:
+                print(''.join(list(difflib.unified_diff(
+                    expected.splitlines(True), html.splitlines(True),
+                    'docutils', 'direct', n=2))[:40]))
+
+    fallback = sum(fallbacks.values())
+    print('rendered %d operations, %d mismatches, %d fell back' % (
+        count, mismatches, fallback))
+    for reason, n in fallbacks.most_common():
+        print('  fallback %s: %d' % (reason, n))
+    print('docutils: %0.2fs direct: %0.2fs speedup: %0.1fx' % (
+        timings['docutils'], timings['direct'],
+        timings['docutils'] / (timings['direct'] or 1)))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()